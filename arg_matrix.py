@@ -0,0 +1,78 @@
+"""Run argument-validation cases concurrently instead of one after another.
+
+Every case only waits for its program to refuse the arguments, so a bounded
+pool of threads (each owning one child process) finishes the whole sweep in
+about one timeout window.
+"""
+import concurrent.futures
+import itertools
+import os
+import subprocess
+
+from common import QUANTUM_SECONDS
+
+CPUS = os.cpu_count() or 1
+MAX_WORKERS = 4 * CPUS
+# up to MAX_WORKERS / CPUS programs start on every CPU at once, each gets as many quanta
+CASE_TIMEOUT = QUANTUM_SECONDS * MAX_WORKERS / CPUS
+
+
+def invalid_argument_cases(valid, invalid_values, pairwise=True):
+    """Copies of ``valid`` with one invalid value put in, and optionally two.
+
+    ``invalid_values[i]`` lists the invalid values for position i.
+    """
+    cases = []
+    positions = range(len(valid))
+    for position in positions:
+        for value in invalid_values[position]:
+            args = list(valid)
+            args[position] = value
+            cases.append(tuple(args))
+    if pairwise:
+        for first, second in itertools.combinations(positions, 2):
+            for value_a, value_b in itertools.product(invalid_values[first], invalid_values[second]):
+                args = list(valid)
+                args[first], args[second] = value_a, value_b
+                cases.append(tuple(args))
+    return cases
+
+
+def wrong_count_cases(valid, extra=2, filler="0"):
+    """Every prefix of ``valid`` that is too short, and ``valid`` with up to ``extra`` more."""
+    cases = [tuple(valid[:count]) for count in range(1, len(valid))]
+    cases += [tuple(valid) + (filler,) * count for count in range(1, extra + 1)]
+    return cases
+
+
+def check_exit_failure(context, args, timeout=CASE_TIMEOUT):
+    """Raise unless the program started by ``context(args, ...)`` rejects ``args``.
+
+    Rejecting means printing something to stderr and exiting with code 1
+    within ``timeout`` seconds.
+    """
+    with context(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as program:
+        line = program.communicate(timeout=timeout)[1]
+        if not line:
+            raise AssertionError("nothing printed to stderr")
+        returncode = program.wait(timeout=timeout)
+        if returncode != 1:
+            raise AssertionError("exit code %d, expected 1" % returncode)
+
+
+def run_cases(cases, check, max_workers=MAX_WORKERS):
+    """Call ``check(case)`` for every case on a thread pool.
+
+    Returns (case, exception) pairs for the cases whose check raised, in the
+    order of ``cases``.
+    """
+    def run(case):
+        try:
+            check(case)
+        except Exception as e:
+            return e
+        return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        results = list(pool.map(run, cases))
+    return [(case, error) for case, error in zip(cases, results) if error is not None]
@@ -0,0 +1,146 @@
+"""Helpers shared by the bench_*.py benchmark scripts.
+
+Every benchmark prints one JSON object per measurement, and also keeps it in
+the results store with the build it measured (see results.py).
+"""
+import argparse
+import bisect
+import contextlib
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import results
+
+MB = 1024 * 1024
+
+
+def argument_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-o", "--output", help="append results to this file instead of stdout")
+    return parser
+
+
+class Reporter:
+    def __init__(self, benchmark, output=None):
+        self.benchmark = benchmark
+        self.output = output
+
+    def __call__(self, **record):
+        record = dict(benchmark=self.benchmark, time=time.time(), **record)
+        line = json.dumps(record, sort_keys=True)
+        if self.output:
+            with open(self.output, "a") as f:
+                print(line, file=f)
+        else:
+            print(line)
+        sys.stdout.flush()
+        results.store(record)
+        return record
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of ``values`` (0 < p <= 100), None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def summary(values):
+    """p50/p99/max/mean of ``values``, the usual shape of a latency report."""
+    if not values:
+        return dict(count=0, p50=None, p99=None, max=None, mean=None)
+    return dict(count=len(values), p50=percentile(values, 50), p99=percentile(values, 99),
+                max=max(values), mean=sum(values) / len(values))
+
+
+HISTOGRAM_EDGES = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+
+def histogram(values, edges=HISTOGRAM_EDGES):
+    """How many of ``values`` fall at or below each edge (and above the previous one).
+
+    Keys are the edges formatted with %g, and "inf" for values above the last.
+    """
+    counts = [0] * (len(edges) + 1)
+    for value in values:
+        counts[bisect.bisect_left(edges, value)] += 1
+    return dict(zip(["%g" % edge for edge in edges] + ["inf"], counts))
+
+
+@contextlib.contextmanager
+def reaping(program):
+    """Kill and reap ``program`` on the way out, unless it has been reaped already."""
+    try:
+        yield program
+    finally:
+        if program.returncode is None:
+            program.kill()
+            program.wait()
+
+
+def wait_with_rusage(program, timeout=None):
+    """Reap ``program`` and return its resource usage (ru_utime, ru_stime, ...).
+
+    Unlike Popen.wait this gives CPU time of exactly that child.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        pid, status, rusage = os.wait4(program.pid, os.WNOHANG if deadline else 0)
+        if pid:
+            program.returncode = os.waitstatus_to_exitcode(status)
+            return rusage
+        if time.monotonic() >= deadline:
+            raise subprocess.TimeoutExpired(program.args, timeout)
+        time.sleep(0.001)
+
+
+def cpu_seconds(rusage):
+    return rusage.ru_utime + rusage.ru_stime
+
+
+class PipeDrain(threading.Thread):
+    """Read a pipe to the end on a background thread and count the bytes.
+
+    Subclasses choose where each read goes (_next_view) and what is noted
+    about it (_account); see capture.StdoutCapture.
+    """
+
+    def __init__(self, pipe, chunk_size=1024 * 1024, start=True):
+        super().__init__(daemon=True)
+        self.pipe = pipe
+        self.bytes = 0
+        self.started = None
+        self.first_read = None
+        self.last_read = None  # time.monotonic() of the latest data
+        self.finished = threading.Event()
+        self._buffer = bytearray(chunk_size)
+        self._view = memoryview(self._buffer)
+        if start:
+            self.start()
+
+    def run(self):
+        pipe = getattr(self.pipe, "raw", self.pipe)  # return what is there, don't fill the buffer
+        self.started = time.monotonic()
+        try:
+            while True:
+                received = pipe.readinto(self._next_view())
+                if not received:
+                    return
+                self._account(time.monotonic(), received)
+        finally:
+            self.finished.set()
+
+    def _next_view(self):
+        return self._view
+
+    def _account(self, now, received):
+        if self.first_read is None:
+            self.first_read = now
+        self.last_read = now
+        self.bytes += received
\ No newline at end of file
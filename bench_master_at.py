@@ -0,0 +1,162 @@
+"""How accurately the master runs AT schedules, and how it copes with many of them.
+
+--entries AT commands are sent at once, spread over the next --minutes minute
+boundaries (so hundreds of schedules cost --minutes + --duration minutes of
+waiting, not one minute each), all running --duration minutes. The master's
+ssh is the fake one in bin/, which logs when every player was started; the
+end of every remote command is caught through a pidfd. Reported per run:
+
+start_drift  ssh started minus the scheduled time, in seconds
+run_drift    how much longer (or shorter) than --duration the player ran
+control      reply latency of a client sending a command every --probe
+             seconds, overall and within a second after a schedule fired
+"""
+import datetime
+import os
+import select
+import tempfile
+import threading
+import time
+
+import fake_ssh
+from bench import Reporter, argument_parser, summary
+from choose_port import reserved_ports
+from common import WAIT_TIMEOUT, mock_client
+from icy_server import IcyServer, StreamProfile
+from test_master import PLAYER_HOSTNAME, running_master
+
+FIRING_WINDOW = 1.0  # seconds after a scheduled minute counted as "while firing"
+
+
+def schedule(count, minutes, lead):
+    """Start times for ``count`` entries, round robin over ``minutes`` minute boundaries."""
+    first = datetime.datetime.now().replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    if first - datetime.datetime.now() < datetime.timedelta(seconds=lead):
+        first += datetime.timedelta(minutes=1)
+    return [first + datetime.timedelta(minutes=i % minutes) for i in range(count)]
+
+
+class ExitWatcher(threading.Thread):
+    """Notes when each added pid exits, with one poll() over pidfds for all of them."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.exits = {}  # pid -> time.monotonic() of the exit
+        self._poll = select.poll()
+        self._pids = {}  # pidfd -> pid
+        self._stopped = threading.Event()
+
+    def add(self, pid):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            self.exits[pid] = time.monotonic()
+            return
+        self._pids[pidfd] = pid
+        self._poll.register(pidfd, select.POLLIN)
+
+    def run(self):
+        while not self._stopped.is_set():
+            for pidfd, _ in self._poll.poll(100):
+                self.exits[self._pids.pop(pidfd)] = time.monotonic()
+                self._poll.unregister(pidfd)
+                os.close(pidfd)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Prober(threading.Thread):
+    """Sends a command every ``interval`` seconds and times the reply."""
+
+    def __init__(self, port, interval):
+        super().__init__(daemon=True)
+        self.port = port
+        self.interval = interval
+        self.replies = []  # (sent at, latency)
+        self.timeouts = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        with mock_client(self.port) as client:
+            while not self._stopped.wait(self.interval):
+                sent = time.monotonic()
+                client.send(b"PAUSE 0\n")
+                try:
+                    client.readline()
+                except OSError:
+                    self.timeouts += 1
+                    continue
+                self.replies.append((sent, time.monotonic() - sent))
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def run(entries, minutes, duration, lead, probe, rate):
+    to_monotonic = time.monotonic() - time.time()
+    with IcyServer(StreamProfile(rate=rate)) as server, tempfile.TemporaryDirectory() as directory, \
+            reserved_ports(entries) as ports:
+        log_path = os.path.join(directory, "ssh.log")
+        with running_master(env=fake_ssh.environment(log_path)) as (program, port), \
+                mock_client(port) as client:
+            starts = schedule(entries, minutes, lead)
+            commands = b"".join(
+                b"AT %d.%02d %d %s %s %s %d %s %d no\n"
+                % (when.hour, when.minute, duration, PLAYER_HOSTNAME, server.host.encode(), b"/",
+                   server.port, os.devnull.encode(), udp_port)
+                for when, udp_port in zip(starts, ports))
+            client.sendall(commands)
+            accepted = sum(reply.startswith(b"OK") for reply in client.readlines(entries))
+
+            scheduled = {udp_port: when.timestamp() + to_monotonic for when, udp_port in zip(starts, ports)}
+            started = {}  # udp port -> (pid, time ssh was started)
+            watcher = ExitWatcher()
+            watcher.start()
+            prober = Prober(port, probe)
+            prober.start()
+            deadline = max(scheduled.values()) + duration * 60 + 2 * WAIT_TIMEOUT
+            # the log is read every 50 ms; that only delays noticing a start, the times come from the log
+            while time.monotonic() < deadline and len(watcher.exits) < accepted:
+                for invocation in fake_ssh.read_log(log_path):
+                    udp_port = next((p for p in ports if str(p) in invocation["command"].split()), None)
+                    if udp_port is not None and udp_port not in started:
+                        started[udp_port] = (invocation["pid"], invocation["time"])
+                        watcher.add(invocation["pid"])
+                time.sleep(0.05)
+            prober.stop()
+            watcher.stop()
+
+    start_drift = [at - scheduled[udp_port] for udp_port, (_, at) in started.items()]
+    run_drift = [watcher.exits[pid] - at - duration * 60
+                 for pid, at in started.values() if pid in watcher.exits]
+    fire_times = sorted(set(scheduled.values()))
+    while_firing = [latency for sent, latency in prober.replies
+                    if any(0 <= sent - fired < FIRING_WINDOW for fired in fire_times)]
+    return dict(entries=entries, minutes=minutes, duration=duration, accepted=accepted,
+                started=len(started), stopped=len(run_drift),
+                start_drift=summary(start_drift), early_starts=sum(drift < 0 for drift in start_drift),
+                run_drift=summary(run_drift),
+                control_latency=summary([latency for _, latency in prober.replies]),
+                control_latency_while_firing=summary(while_firing), control_timeouts=prober.timeouts)
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--entries", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--minutes", type=int, default=2, help="minute boundaries the entries are spread over")
+    parser.add_argument("--duration", type=int, default=1, help="minutes every player runs")
+    parser.add_argument("--lead", type=float, default=10, help="least seconds between sending and the first start")
+    parser.add_argument("--probe", type=float, default=0.05, help="seconds between control commands")
+    parser.add_argument("--rate", type=int, default=2000, help="stream bytes per second per player")
+    options = parser.parse_args(argv)
+    report = Reporter("master_at", options.output)
+
+    for entries in options.entries:
+        report(**run(entries, options.minutes, options.duration, options.lead, options.probe, options.rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Where does the master's connection handling stop scaling?
+
+Control connections to one master are added in steps up to the largest
+--levels value. Every new connection sends one bogus command, which gives the
+time until the master accepted it and answered. Between steps a few --active
+clients keep sending commands for --hold seconds, measuring how responsive the
+master stays, and the master's RSS and open fds are read from /proc.
+"""
+import asyncio
+import resource
+import time
+
+from bench import Reporter, argument_parser, summary
+from common import WAIT_TIMEOUT
+from proc_stats import ProcessSampler
+from test_master import running_master
+
+
+def raise_fd_limit():
+    """Allow as many fds as the hard limit; the master inherits it."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+async def open_idle(port, connect_latencies, reply_latencies, failures):
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), WAIT_TIMEOUT)
+        connected = time.perf_counter()
+        writer.write(b"HELLO\n")
+        await asyncio.wait_for(reader.readline(), WAIT_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        failures.append(time.perf_counter() - started)
+        return None
+    connect_latencies.append(connected - started)
+    reply_latencies.append(time.perf_counter() - connected)
+    return writer
+
+
+async def active_client(port, hold, interval, latencies, failures):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    stop_at = time.monotonic() + hold
+    try:
+        while time.monotonic() < stop_at:
+            started = time.perf_counter()
+            writer.write(b"PAUSE 0\n")
+            try:
+                await asyncio.wait_for(reader.readline(), WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                failures.append(WAIT_TIMEOUT)
+                return
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(interval)
+    finally:
+        writer.close()
+
+
+async def run(port, program, levels, batch, active, hold, interval, report):
+    sampler = ProcessSampler(program)
+    idle = []
+    for level in levels:
+        connect_latencies, reply_latencies, failures = [], [], []
+        step_started = time.monotonic()
+        while len(idle) < level:
+            count = min(batch, level - len(idle))
+            writers = await asyncio.gather(*(open_idle(port, connect_latencies, reply_latencies, failures)
+                                             for _ in range(count)))
+            idle += [writer for writer in writers if writer is not None]
+            if failures:
+                break
+        step_seconds = time.monotonic() - step_started
+
+        active_latencies, active_failures = [], []
+        await asyncio.gather(*(active_client(port, hold, interval, active_latencies, active_failures)
+                               for _ in range(active)))
+        sampler.sample()
+        report(connections=len(idle), target=level, step_seconds=step_seconds,
+               connect_latency=summary(connect_latencies), first_reply_latency=summary(reply_latencies),
+               failed_connections=len(failures),
+               active_latency=summary(active_latencies), active_timeouts=len(active_failures),
+               master_rss_kb=sampler.rss_kb, master_fds=sampler.fds, master_cpu_seconds=sampler.cpu_seconds)
+        if failures:
+            break
+    for writer in idle:
+        writer.close()
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--levels", type=int, nargs="+", default=[100, 500, 1000, 2000, 5000, 10000])
+    parser.add_argument("--batch", type=int, default=100, help="connections opened at once")
+    parser.add_argument("--active", type=int, default=5)
+    parser.add_argument("--hold", type=float, default=3, help="seconds of active traffic per level")
+    parser.add_argument("--interval", type=float, default=0.01, help="pause between commands of an active client")
+    options = parser.parse_args(argv)
+    report = Reporter("master_connections", options.output)
+
+    fd_limit = raise_fd_limit()
+    if max(options.levels) + options.active + 100 > fd_limit:
+        parser.error("fd limit is %d, lower --levels" % fd_limit)
+    with running_master() as (program, port):
+        asyncio.run(run(port, program, options.levels, options.batch, options.active,
+                        options.hold, options.interval, report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""How quickly and reliably the master reports players that crash.
+
+--players players are started through the master (with the fake ssh in bin/,
+so they run here and can be killed directly). They are killed with SIGKILL in
+waves of --waves sizes; within a wave kills are --spacing seconds apart (0
+kills the whole wave at once). Every line from the master is timestamped as it
+arrives, and each ERROR <id> is matched with its kill. Reported per wave:
+latency from kill to notification, and the ids whose notification was lost,
+duplicated, or that were reported without being killed. STARTs the master
+refuses are counted and left out of the waves.
+"""
+import collections
+import contextlib
+import os
+import re
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+import fake_ssh
+from bench import Reporter, argument_parser, summary
+from bench_master_spawn import kill_players
+from choose_port import reserved_ports
+from common import WAIT_TIMEOUT, mock_client
+from icy_server import IcyServer, StreamProfile
+from proc_stats import find_descendant
+from test_master import PLAYER_HOSTNAME, running_master
+from wait import wait_for_port, wait_until
+
+ERROR_LINE = re.compile(rb"^ERROR\s+(\d+)")
+
+
+class LineReader(threading.Thread):
+    """Timestamps every line the master sends on ``client``."""
+
+    def __init__(self, client):
+        super().__init__(daemon=True)
+        self.client = client
+        self.errors = collections.defaultdict(list)  # player id -> arrival times of ERROR lines
+        self.other = []
+        self._lock = threading.Lock()  # guards errors against readers on other threads
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                line = self.client.readline(timeout=0.1)
+            except socket.timeout:
+                continue
+            except EOFError:
+                return
+            now = time.monotonic()
+            match = ERROR_LINE.match(line)
+            if match:
+                with self._lock:
+                    self.errors[match.group(1)].append(now)
+            else:
+                self.other.append(line)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def reported(self, player_ids):
+        """Has an ERROR arrived for every one of ``player_ids``?"""
+        with self._lock:
+            return all(self.errors.get(i) for i in player_ids)
+
+    def snapshot(self):
+        """{player id: arrival times of its ERROR lines} so far."""
+        with self._lock:
+            return {i: list(times) for i, times in self.errors.items()}
+
+
+def start_players(client, master, server, ports, output):
+    """START a player on each of ``ports``; return [(player id, pid)] once all listen on their command port.
+
+    Also returns the replies to the STARTs the master refused.
+    """
+    started, refused = [], []
+    args_list = [(server.host, "/", str(server.port), output, str(port), "no") for port in ports]
+    client.sendall(b"".join(b"START %s %s\n" % (PLAYER_HOSTNAME, " ".join(args).encode()) for args in args_list))
+    for args, reply in zip(args_list, client.readlines(len(ports))):
+        fields = reply.split()
+        if fields[:1] != [b"OK"] or len(fields) < 2:
+            refused.append(reply.strip().decode(errors="replace"))
+            continue
+        player_id = fields[1]
+        pid = wait_until(lambda: find_descendant(master.pid, args))
+        wait_for_port(int(args[4]), socket.SOCK_DGRAM)
+        started.append((player_id, pid))
+    return started, refused
+
+
+def run(players, waves, spacing, rate):
+    """Kill the players wave by wave; return one result dict per wave."""
+    with IcyServer(StreamProfile(rate=rate)) as server, tempfile.TemporaryDirectory() as directory, \
+            reserved_ports(players) as ports:
+        log_path = os.path.join(directory, "ssh.log")
+        with running_master(env=fake_ssh.environment(log_path)) as (program, port), \
+                mock_client(port) as client, contextlib.ExitStack() as stack:
+            stack.callback(kill_players, log_path)  # the ones no wave killed, and any half-started
+            alive, refused = start_players(client, program, server, ports, os.devnull)
+            reader = LineReader(client)
+            reader.start()
+            stack.callback(reader.stop)
+            waves_seen = []
+            for size in waves:
+                wave, alive = alive[:size], alive[size:]
+                killed = {}  # player id -> time of the kill
+                next_kill = time.monotonic()
+                for player_id, pid in wave:
+                    delay = next_kill - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    killed[player_id] = time.monotonic()
+                    os.kill(pid, signal.SIGKILL)
+                    next_kill += spacing
+                deadline = time.monotonic() + WAIT_TIMEOUT
+                while time.monotonic() < deadline and not reader.reported(killed):
+                    time.sleep(0.01)
+                time.sleep(min(spacing * size, 1) + 0.1)  # let duplicates arrive
+                waves_seen.append((size, killed, reader.snapshot()))
+
+    results = []
+    killed_so_far = set()
+    for size, killed, errors in waves_seen:
+        killed_so_far |= set(killed)
+        latencies = [errors[i][0] - at for i, at in killed.items() if errors.get(i)]
+        results.append(dict(players=players, wave=size, spacing=spacing, start_errors=len(refused),
+                            latency=summary(latencies),
+                            lost=sorted(int(i) for i in killed if not errors.get(i)),
+                            duplicated=sorted(int(i) for i in killed if len(errors.get(i, ())) > 1),
+                            unexpected=sorted(int(i) for i in errors if i not in killed_so_far)))
+    return results
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--players", type=int, default=100)
+    parser.add_argument("--waves", type=int, nargs="+", default=[1, 1, 1, 10, 50],
+                        help="players killed in each wave, in order")
+    parser.add_argument("--spacing", type=float, default=0, help="seconds between kills within a wave")
+    parser.add_argument("--rate", type=int, default=2000, help="stream bytes per second per player")
+    options = parser.parse_args(argv)
+    if sum(options.waves) > options.players:
+        parser.error("the waves kill more than --players players")
+    report = Reporter("master_crash", options.output)
+
+    for result in run(options.players, options.waves, options.spacing, options.rate):
+        report(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Latency of the master's control protocol with many operators connected.
+
+For every concurrency level the benchmark opens that many control
+connections and sends a mix of START/AT/PLAY/PAUSE/TITLE/QUIT at --rate
+commands per second in total, measuring the time from writing a command to
+reading its OK/ERROR line. Replies are matched to their command by player id;
+ERROR lines the master sends by itself when a player crashes are counted
+separately, as are lines that answer nothing.
+"""
+import asyncio
+import collections
+import random
+import socket
+import time
+
+from bench import Reporter, argument_parser, summary
+from choose_port import choose_port, release_port
+from common import WAIT_TIMEOUT, at_time_later
+from icy_server import shared_server
+from test_master import PLAYER_HOSTNAME, running_master
+from wait import is_listening
+
+COMMANDS = ("PLAY", "PAUSE", "TITLE", "QUIT")
+PORTS_PER_OPERATOR = 4  # command ports a connection rotates through
+
+
+def player_args(command_port):
+    radio = shared_server()
+    return b"%s / %d - %d no" % (radio.host.encode(), radio.port, command_port)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = 0
+        self.timeouts = 0
+        self.crash_notifications = 0  # ERROR <id> lines nobody asked for
+        self.unmatched = 0  # any other line that answers no command
+
+    def add(self, command, seconds, ok):
+        self.latencies.setdefault(command, []).append(seconds)
+        if not ok:
+            self.errors += 1
+
+    def all_latencies(self):
+        return [value for values in self.latencies.values() for value in values]
+
+
+def reply_id(fields):
+    """Player id an OK/ERROR line is about ("ERROR 3: crashed" included), None if it names none."""
+    return fields[1].rstrip(b":") if len(fields) > 1 else None
+
+
+class Connection:
+    """A control connection whose reader matches every line to the command it answers.
+
+    The master also writes ERROR <id> on its own when a player dies, so the
+    next line is not necessarily the reply: a reply to PLAY/PAUSE/TITLE/QUIT
+    names the player it was sent for, and a reply to START/AT is an OK or an
+    ERROR about none of the players started here.
+    """
+
+    def __init__(self, reader, writer, stats):
+        self.reader = reader
+        self.writer = writer
+        self.stats = stats
+        self.players = set()  # ids ever started on this connection
+        self.crashed = set()
+        self._pending = None  # (player id or None, future of the reply)
+        self._task = asyncio.ensure_future(self._read())
+
+    def _answers(self, fields):
+        player_id = self._pending[0]
+        if player_id is not None:
+            return reply_id(fields) == player_id
+        return fields[:1] == [b"OK"] or reply_id(fields) not in self.players
+
+    async def _read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            fields = line.split()
+            if self._pending is not None and not self._pending[1].done() and self._answers(fields):
+                self._pending[1].set_result(fields)
+            elif fields[:1] == [b"ERROR"] and reply_id(fields) in self.players:
+                self.stats.crash_notifications += 1
+                self.crashed.add(reply_id(fields))
+            else:
+                self.stats.unmatched += 1
+
+    async def request(self, command, name, player_id=None):
+        """Send ``command`` and return the fields of its reply, None after a timeout."""
+        reply = asyncio.get_running_loop().create_future()
+        self._pending = (player_id, reply)
+        started = time.perf_counter()
+        self.writer.write(command)
+        try:
+            fields = await asyncio.wait_for(reply, WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            return None
+        finally:
+            self._pending = None
+        self.stats.add(name, time.perf_counter() - started, fields[:1] == [b"OK"])
+        if player_id is None and fields[:1] == [b"OK"] and len(fields) > 1:
+            self.players.add(fields[1])
+        return fields
+
+    def close(self):
+        self._task.cancel()
+        self.writer.close()
+
+
+def free_port(ports):
+    """Rotate to a port of ``ports`` nobody listens on, None if all are still taken.
+
+    A QUIT is answered before the player has gone, so the next START must not
+    reuse the port of the player just stopped.
+    """
+    for _ in range(len(ports)):
+        ports.rotate(-1)
+        if not is_listening(ports[0], socket.SOCK_DGRAM):
+            return ports[0]
+    return None
+
+
+async def operator(port, stop_at, interval, stats):
+    """One control connection: keep a player around and poke it at ``interval``."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    connection = Connection(reader, writer, stats)
+    command_ports = collections.deque(choose_port() for _ in range(PORTS_PER_OPERATOR))
+    player_id = None  # an operator has at most one player at a time
+    next_send = time.monotonic() + random.uniform(0, interval)
+    try:
+        while time.monotonic() < stop_at:
+            await asyncio.sleep(max(next_send - time.monotonic(), 0))
+            next_send += interval
+            if player_id in connection.crashed:
+                player_id = None
+            if player_id is None:
+                command_port = free_port(command_ports)
+                if command_port is None:
+                    continue
+                args = player_args(command_port)
+                if random.random() < 0.5:
+                    name, command = "START", b"START %s %s\n" % (PLAYER_HOSTNAME, args)
+                else:
+                    name, command = "AT", b"AT %s 1 %s %s\n" % (at_time_later(), PLAYER_HOSTNAME, args)
+                reply = await connection.request(command, name)
+                if reply is None:
+                    break  # a late OK would leave a player nobody QUITs
+                if reply[:1] == [b"OK"]:
+                    player_id = reply[1]
+                continue
+            name = random.choice(COMMANDS)
+            if await connection.request(b"%s %s\n" % (name.encode(), player_id), name, player_id) is None:
+                break
+            if name == "QUIT":
+                player_id = None
+        if player_id is not None:
+            await connection.request(b"QUIT %s\n" % player_id, "QUIT", player_id)
+    finally:
+        connection.close()
+        for command_port in command_ports:
+            release_port(command_port)
+
+
+async def run_level(port, concurrency, rate, duration):
+    stats = Stats()
+    stop_at = time.monotonic() + duration
+    interval = concurrency / rate
+    results = await asyncio.gather(*(operator(port, stop_at, interval, stats) for _ in range(concurrency)),
+                                   return_exceptions=True)
+    failed_connections = sum(isinstance(result, Exception) for result in results)
+    return stats, failed_connections
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100, 200, 500])
+    parser.add_argument("--rate", type=float, default=200, help="commands per second, all connections together")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per concurrency level")
+    options = parser.parse_args(argv)
+    report = Reporter("master_load", options.output)
+
+    with running_master() as (program, port):
+        for concurrency in options.concurrency:
+            stats, failed_connections = asyncio.run(run_level(port, concurrency, options.rate, options.duration))
+            latencies = stats.all_latencies()
+            total = len(latencies) + stats.timeouts
+            report(concurrency=concurrency, target_rate=options.rate, commands=total,
+                   achieved_rate=total / options.duration,
+                   latency=summary(latencies),
+                   latency_by_command={name: summary(values) for name, values in stats.latencies.items()},
+                   errors=stats.errors, timeouts=stats.timeouts,
+                   crash_notifications=stats.crash_notifications, unmatched_lines=stats.unmatched,
+                   error_rate=(stats.errors + stats.timeouts) / total if total else None,
+                   failed_connections=failed_connections)
+
+
+if __name__ == '__main__':
+    main()
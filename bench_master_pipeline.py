@@ -0,0 +1,63 @@
+"""Throughput of pipelined commands on one master control connection.
+
+A batch of --count AT/bogus command lines (see test_master.pipelined_commands)
+is written either in a single send or in tiny segments, and all replies are
+read back. Reported are commands per second and whether every command got
+exactly one reply of the right kind, in order.
+"""
+import socket
+import threading
+import time
+
+from bench import Reporter, argument_parser
+from common import QUANTUM_SECONDS, WAIT_TIMEOUT, mock_client
+from test_master import pipelined_commands, running_master, send_in_segments
+
+MODES = ("single_send", "segments")
+
+
+def run(port, count, mode):
+    data, expect_ok = pipelined_commands(count)
+    with mock_client(port) as client:
+        # write from another thread, or both sides could block on full socket buffers
+        if mode == "segments":
+            writer = threading.Thread(target=send_in_segments, args=(client, data), kwargs=dict(pause=0))
+        else:
+            writer = threading.Thread(target=client.sendall, args=(data,))
+        started = time.monotonic()
+        writer.start()
+        replies = client.readlines(count, timeout=WAIT_TIMEOUT + count / 1000)
+        elapsed = time.monotonic() - started
+        writer.join()
+        try:
+            client.readline(timeout=QUANTUM_SECONDS)
+            extra_reply = True
+        except socket.timeout:
+            extra_reply = False
+
+        wrong = sum(reply.startswith(b"OK") != ok for reply, ok in zip(replies, expect_ok))
+        ids = [reply.split()[1] for reply in replies if reply.startswith(b"OK") and len(reply.split()) == 2]
+        # drop the scheduled players again, pipelined as well
+        client.sendall(b"".join(b"QUIT %s\n" % player_id for player_id in ids))
+        client.readlines(len(ids), timeout=WAIT_TIMEOUT + count / 1000)
+
+    return dict(count=count, mode=mode, bytes=len(data), seconds=elapsed,
+                commands_per_s=count / elapsed, wrong_replies=wrong,
+                duplicate_ids=len(ids) - len(set(ids)), extra_reply=extra_reply)
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--count", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--mode", choices=MODES, action="append")
+    options = parser.parse_args(argv)
+    report = Reporter("master_pipeline", options.output)
+
+    with running_master() as (program, port):
+        for mode in options.mode or MODES:
+            for count in options.count:
+                report(**run(port, count, mode))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""How quickly does the master launch players when many requests come at once?
+
+The master runs with the fake ssh from bin/ on PATH, so no sshd is needed and
+the "connection" can be made artificially slow with --ssh-delay. All START
+(or AT, scheduled for the next minute) requests are written at once, spread
+over --connections control connections. Reported are the reply latency, the
+spawn latency (request, or scheduled time for AT, until ssh is invoked) and
+how many ssh sessions were connecting at the same time.
+"""
+import contextlib
+import datetime
+import os
+import signal
+import tempfile
+import time
+
+import fake_ssh
+from bench import Reporter, argument_parser, summary
+from choose_port import reserved_ports
+from common import WAIT_TIMEOUT, mock_client
+from icy_server import shared_server
+from test_master import PLAYER_HOSTNAME, running_master
+from wait import WaitTimeout, wait_until
+
+
+def max_overlap(intervals):
+    """Largest number of (start, end) intervals open at the same moment."""
+    events = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    current = peak = 0
+    for _, change in events:
+        current += change
+        peak = max(peak, current)
+    return peak
+
+
+def next_minute():
+    """(b"HH.MM", time.monotonic() at which that minute starts)."""
+    now = datetime.datetime.now()
+    start = now.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    return b"%d.%d" % (start.hour, start.minute), time.monotonic() + (start - now).total_seconds()
+
+
+def kill_players(log_path):
+    for record in fake_ssh.read_log(log_path, "exec"):
+        try:
+            os.kill(record["pid"], signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def run(players, connections, command, ssh_delay):
+    radio = shared_server()
+    due = {}  # player port -> monotonic time the player should be spawned at
+    replies = []
+    with tempfile.TemporaryDirectory() as directory, reserved_ports(players) as ports:
+        log_path = os.path.join(directory, "ssh.log")
+        with running_master(env=fake_ssh.environment(log_path, ssh_delay)) as (program, port):
+            with contextlib.ExitStack() as stack:
+                stack.callback(kill_players, log_path)
+                sockets = [stack.enter_context(mock_client(port)) for _ in range(connections)]
+                batches = [[] for _ in sockets]
+                for i, player_port in enumerate(ports):
+                    args = b"%s / %d - %d no" % (radio.host.encode(), radio.port, player_port)
+                    if command == "AT":
+                        at, starts = next_minute()
+                        line = b"AT %s 1 %s %s\n" % (at, PLAYER_HOSTNAME, args)
+                    else:
+                        line, starts = b"START %s %s\n" % (PLAYER_HOSTNAME, args), None
+                    batches[i % connections].append((player_port, line, starts))
+
+                sent = time.monotonic()
+                for sock, batch in zip(sockets, batches):
+                    sock.sendall(b"".join(line for _, line, _ in batch))
+                for sock, batch in zip(sockets, batches):
+                    for player_port, _, starts in batch:
+                        line = sock.readline(timeout=WAIT_TIMEOUT)
+                        replies.append((time.monotonic() - sent, line.startswith(b"OK")))
+                        due[player_port] = starts or sent
+
+                wait_window = max(due.values()) - time.monotonic() + WAIT_TIMEOUT + ssh_delay
+                try:
+                    wait_until(lambda: len(fake_ssh.read_log(log_path)) >= players, timeout=wait_window)
+                except WaitTimeout:
+                    pass
+                connects = fake_ssh.read_log(log_path)
+                execs = {record["pid"]: record["time"] for record in fake_ssh.read_log(log_path, "exec")}
+
+    spawn_latencies, sessions = [], []
+    for record in connects:
+        player_ports = [int(word) for word in record["command"].split() if word.isdigit() and int(word) in due]
+        if player_ports:
+            spawn_latencies.append(record["time"] - due[player_ports[0]])
+        sessions.append((record["time"], execs.get(record["pid"], record["time"])))
+    return dict(players=players, connections=connections, command=command, ssh_delay=ssh_delay,
+                reply_latency=summary([seconds for seconds, _ in replies]),
+                errors=sum(not ok for _, ok in replies),
+                spawned=len(connects), missing=players - len(connects),
+                spawn_latency=summary(spawn_latencies),
+                max_concurrent_ssh=max_overlap(sessions))
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--players", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--connections", type=int, default=1)
+    parser.add_argument("--command", choices=("START", "AT"), default="START")
+    parser.add_argument("--ssh-delay", type=float, default=0.1, help="seconds fake ssh spends connecting")
+    options = parser.parse_args(argv)
+    report = Reporter("master_spawn", options.output)
+
+    for players in options.players:
+        report(**run(players, options.connections, options.command, options.ssh_delay))
+
+
+if __name__ == '__main__':
+    main()
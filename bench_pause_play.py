@@ -0,0 +1,66 @@
+"""How quickly PAUSE and PLAY take effect on the player's output.
+
+The local ICY server streams at --rate bytes per second and the player writes
+to stdout (timestamped on every read by a StdoutCapture) or to a file
+(timestamped on every inotify change by FileArrivals). Each of --cycles
+rounds sends PAUSE, waits until the output has been quiet for --quiet
+seconds, then sends PLAY and waits for the first new byte. Reported are the
+bytes still written after PAUSE, the time from PAUSE to the last of them and
+the time from PLAY to the first byte.
+"""
+import os
+import socket
+import subprocess
+import tempfile
+
+from bench import Reporter, argument_parser, summary
+from capture import FileArrivals, StdoutCapture, measure_pause_play
+from choose_port import choose_port
+from icy_server import IcyServer, StreamProfile
+from test_player import player_context
+
+
+def run(mode, cycles, quiet, rate, metaint):
+    effects = []
+    with IcyServer(StreamProfile(rate=rate, metaint=metaint)) as server, \
+            tempfile.TemporaryDirectory() as directory, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        output = "-" if mode == "stdout" else os.path.join(directory, "out.mp3")
+        port = choose_port()
+        args = (server.host, "/", str(server.port), output, str(port), "yes")
+        address = ("127.0.0.1", port)
+        stdout = subprocess.PIPE if mode == "stdout" else subprocess.DEVNULL
+        with player_context(args, stdout=stdout, stderr=subprocess.DEVNULL) as program:
+            if mode == "stdout":
+                log = StdoutCapture(program.stdout, record_arrivals=True)
+            else:
+                log = FileArrivals(output)
+            log.start()
+            for _ in range(cycles):
+                effects.append(measure_pause_play(log, lambda: sock.sendto(b"PAUSE", address),
+                                                  lambda: sock.sendto(b"PLAY", address), quiet))
+            if mode == "file":
+                log.stop()
+
+    return dict(mode=mode, cycles=cycles, quiet=quiet, rate=rate, metaint=metaint,
+                bytes_after_pause=summary([effect["bytes_after_pause"] for effect in effects]),
+                pause_to_last_byte=summary([effect["pause_to_last_byte"] for effect in effects]),
+                play_to_first_byte=summary([effect["play_to_first_byte"] for effect in effects]))
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--mode", choices=("stdout", "file"), action="append")
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--quiet", type=float, default=0.2, help="seconds without output that count as paused")
+    parser.add_argument("--rate", type=int, default=16000 * 8, help="stream bytes per second")
+    parser.add_argument("--metaint", type=int, default=8192)
+    options = parser.parse_args(argv)
+    report = Reporter("pause_play", options.output)
+
+    for mode in options.mode or ("stdout", "file"):
+        report(**run(mode, options.cycles, options.quiet, options.rate, options.metaint))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""UDP command latency of a streaming player while it is flooded with commands.
+
+For every flood rate a fresh player streams from the local ICY server to
+stdout while a background thread sends --flood commands at that rate. A
+separate socket meanwhile measures TITLE round trips (counting unanswered
+ones as dropped) and how long PAUSE and PLAY take to show on the byte
+stream. Streaming throughput is reported for each rate, so rate 0 is the
+baseline for the others. Note that a "mixed" flood pauses the stream by itself.
+"""
+import contextlib
+import random
+import socket
+import string
+import subprocess
+import threading
+import time
+
+from bench import MB, Reporter, argument_parser, summary
+from capture import StdoutCapture, measure_pause_play
+from choose_port import choose_port
+from icy_server import IcyServer, StreamProfile
+from test_player import player_context
+from wait import WaitTimeout
+
+FLOODS = {
+    "junk": lambda: ''.join(random.choice(string.ascii_uppercase + string.digits)
+                            for _ in range(random.randint(4, 6))).encode(),
+    "title": lambda: b"TITLE",
+    "mixed": lambda: random.choice((b"PAUSE", b"PLAY", b"TITLE")),
+}
+PROBE_TIMEOUT = 0.5
+QUIET = 0.2  # no output for this long means the player has paused
+
+
+class Flood(threading.Thread):
+    def __init__(self, port, rate, make_command):
+        super().__init__(daemon=True)
+        self.address = ("127.0.0.1", port)
+        self.rate = rate
+        self.make_command = make_command
+        self.sent = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        if not self.rate:
+            return
+        batch = max(int(self.rate / 100), 1)
+        started = time.monotonic()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            while not self.stopped.is_set():
+                for _ in range(batch):
+                    sock.sendto(self.make_command(), self.address)
+                self.sent += batch
+                delay = started + self.sent / self.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def title_round_trip(sock, address):
+    """Seconds until TITLE is answered, None if the reply got lost."""
+    sock.setblocking(False)
+    with contextlib.suppress(BlockingIOError):
+        while True:
+            sock.recv(4096)  # late replies to earlier, dropped probes
+    sock.settimeout(PROBE_TIMEOUT)
+    started = time.perf_counter()
+    sock.sendto(b"TITLE", address)
+    try:
+        sock.recvfrom(4096)
+    except socket.timeout:
+        return None
+    return time.perf_counter() - started
+
+
+def pause_play_latency(sock, address, capture):
+    """Send PAUSE and PLAY; return (seconds until the last byte, seconds until the first byte)."""
+    capture.record_arrivals = True  # only now, the stream ran unlogged until here
+    effect = measure_pause_play(capture, lambda: sock.sendto(b"PAUSE", address),
+                                lambda: sock.sendto(b"PLAY", address), QUIET)
+    return effect["pause_to_last_byte"], effect["play_to_first_byte"]
+
+
+def run_level(rate, flood, probes, duration, stream_rate):
+    profile = StreamProfile(metaint=8192, rate=stream_rate, title_interval=0.5)
+    with IcyServer(profile) as server:
+        port = choose_port()
+        args = (server.host, "/", str(server.port), "-", str(port), "yes")
+        with player_context(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as program, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(PROBE_TIMEOUT)
+            address = ("127.0.0.1", port)
+            drain = StdoutCapture(program.stdout)
+            drain.start()
+            flooder = Flood(port, rate, FLOODS[flood])
+            flooder.start()
+
+            started, start_bytes = time.monotonic(), drain.bytes
+            round_trips, dropped = [], 0
+            interval = duration / probes
+            for _ in range(probes):
+                probe_started = time.monotonic()
+                seconds = title_round_trip(sock, address)
+                if seconds is None:
+                    dropped += 1
+                else:
+                    round_trips.append(seconds)
+                time.sleep(max(probe_started + interval - time.monotonic(), 0))
+            streamed = drain.bytes - start_bytes
+            elapsed = time.monotonic() - started
+
+            try:
+                pause, play = pause_play_latency(sock, address, drain)
+            except WaitTimeout:
+                pause = play = None
+            flooder.stop()
+            alive = program.poll() is None
+
+    return dict(flood_rate=rate, flood=flood, flood_sent=flooder.sent,
+                title_rtt=summary(round_trips), title_dropped=dropped, title_probes=probes,
+                pause_latency=pause, play_latency=play,
+                stream_mb_per_s=streamed / MB / elapsed, player_alive=alive)
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--rates", type=int, nargs="+", default=[0, 1000, 10000, 50000],
+                        help="flood datagrams per second")
+    parser.add_argument("--flood", choices=sorted(FLOODS), default="junk")
+    parser.add_argument("--probes", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=10, help="seconds of probing per rate")
+    parser.add_argument("--stream-rate", type=int, default=None,
+                        help="stream bytes per second (default: as fast as possible)")
+    options = parser.parse_args(argv)
+    report = Reporter("player_commands", options.output)
+
+    for rate in options.rates:
+        report(**run_level(rate, options.flood, options.probes, options.duration, options.stream_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Many players on one host against one upstream.
+
+For every --players count, that many players connect to the same local ICY
+server, each with its own command port and output sink (a file, or stdout
+drained by a PipeDrain). For --duration seconds TITLE is requested from the
+players in turn, which gives the reply latency under load and how many
+replies were behind the title the server last sent. Throughput is summed over
+all players; CPU seconds and context switches are per player, taken from
+/proc before and after the measured window.
+"""
+import os
+import socket
+import subprocess
+import tempfile
+import time
+
+from bench import MB, PipeDrain, Reporter, argument_parser, summary
+from choose_port import choose_port
+from icy_server import IcyServer, StreamProfile
+from proc_stats import ProcessSampler
+from test_player import players_context
+
+
+def sink_bytes(sinks):
+    total = 0
+    for sink in sinks:
+        if not isinstance(sink, str):
+            total += sink.bytes
+        elif os.path.exists(sink):
+            total += os.path.getsize(sink)
+    return total
+
+
+def poll_titles(server, ports, duration, poll):
+    """Ask each player for TITLE in turn; return latencies, stale and lost replies."""
+    latencies, stale, lost = [], 0, 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(max(poll * 10, 0.1))
+        stop_at = time.monotonic() + duration
+        turn = 0
+        while time.monotonic() < stop_at:
+            port = ports[turn % len(ports)]
+            turn += 1
+            latest = server.title_log[-1][1] if server.title_log else None
+            started = time.perf_counter()
+            sock.sendto(b"TITLE", ("127.0.0.1", port))
+            try:
+                reply = sock.recv(65536)
+            except socket.timeout:
+                lost += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            stale += latest is not None and reply.strip(b"'") != latest
+            time.sleep(poll)
+    return latencies, stale, lost
+
+
+def run(count, sink, duration, poll, rate, title_interval):
+    profile = StreamProfile(rate=rate or None, title_interval=title_interval, title_size=64)
+    with IcyServer(profile) as server, tempfile.TemporaryDirectory() as directory:
+        ports = [choose_port() for _ in range(count)]
+        outputs = ["-" if sink == "stdout" else os.path.join(directory, "%d.mp3" % i) for i in range(count)]
+        args_list = [(server.host, "/", str(server.port), output, str(port), "yes")
+                     for output, port in zip(outputs, ports)]
+        stdout = subprocess.PIPE if sink == "stdout" else subprocess.DEVNULL
+        with players_context(args_list, stdout=stdout, stderr=subprocess.DEVNULL) as programs:
+            sinks = [PipeDrain(program.stdout, chunk_size=64 * 1024) for program in programs] \
+                if sink == "stdout" else outputs
+            samplers = [ProcessSampler(program) for program in programs]
+            for sampler in samplers:
+                sampler.sample()
+            cpu_before = [sampler.cpu_seconds for sampler in samplers]
+            switches_before = [sampler.ctxt_switches for sampler in samplers]
+            bytes_before, sent_before = sink_bytes(sinks), server.bytes_sent
+            started = time.monotonic()
+
+            latencies, stale, lost = poll_titles(server, ports, duration, poll)
+
+            elapsed = time.monotonic() - started
+            received = sink_bytes(sinks) - bytes_before
+            sent = server.bytes_sent - sent_before
+            alive = [sampler.sample() for sampler in samplers].count(True)
+            cpu = [sampler.cpu_seconds - before for sampler, before in zip(samplers, cpu_before)]
+            switches = [(sampler.ctxt_switches - before) / elapsed
+                        for sampler, before in zip(samplers, switches_before)]
+
+    return dict(players=count, players_alive=alive, sink=sink, rate=rate, seconds=elapsed,
+                aggregate_mb_per_s=received / MB / elapsed,
+                upstream_mb_per_s=sent / MB / elapsed,
+                cpu_per_player=summary([seconds / elapsed for seconds in cpu]),
+                ctxt_switches_per_s=summary(switches),
+                title_latency=summary(latencies), title_stale=stale, title_lost=lost)
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--players", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--sink", choices=("file", "stdout"), default="file")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--poll", type=float, default=0.01, help="seconds between TITLE requests")
+    parser.add_argument("--rate", type=int, default=16000, help="stream bytes per second per player, 0 for unlimited")
+    parser.add_argument("--title-interval", type=float, default=1)
+    options = parser.parse_args(argv)
+    report = Reporter("player_fanout", options.output)
+
+    for count in options.players:
+        report(**run(count, options.sink, options.duration, options.poll, options.rate, options.title_interval))
+
+
+if __name__ == '__main__':
+    main()
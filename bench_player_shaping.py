@@ -0,0 +1,72 @@
+"""Player throughput and CPU cost when the network cuts the stream into odd pieces.
+
+The same --kilobytes of audio with metadata every 16 bytes are sent through
+each shaping profile (see icy_server.Shaper) and saved to a file. Tiny
+segments make the player's read loop and metadata parser do the most work per
+byte, so CPU per MB and bytes per read syscall are the numbers to watch
+(/proc/<pid>/io counts read(2)-family calls only, not recv(2)).
+"""
+import os
+import subprocess
+import tempfile
+import time
+
+from bench import MB, Reporter, argument_parser, cpu_seconds, reaping, wait_with_rusage
+from choose_port import choose_port
+from common import WAIT_TIMEOUT
+from icy_server import IcyServer, Shaper, StreamProfile
+from proc_stats import ProcessSampler
+from test_player import Player
+from verify import first_mismatch
+
+SHAPERS = {
+    "aligned": dict(),
+    "byte_by_byte": dict(max_segment=1),
+    "tiny_random": dict(max_segment=7, random_segments=True),
+    "mss_random": dict(max_segment=1460, random_segments=True),
+    "split_metadata": dict(split_metadata=True),
+    "split_metadata_tiny": dict(split_metadata=True, max_segment=5, random_segments=True),
+    "capped_1mbit": dict(bandwidth=128 * 1024),
+    "jitter": dict(max_segment=1460, latency=0.0005, jitter=0.002),
+}
+
+
+def run(name, length, metaint):
+    profile = StreamProfile(metaint=metaint, rate=None, length=length, title_interval=0.01)
+    shaper = Shaper(seed=0, **SHAPERS[name])
+    with IcyServer(profile, shaper=shaper) as server, tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, "out.mp3")
+        args = (server.host, "/", str(server.port), output_path, str(choose_port()), "yes")
+        started = time.monotonic()
+        program = Player(args, stdout=subprocess.DEVNULL)
+        sampler = ProcessSampler(program, interval=0.01)
+        sampler.start()
+        try:
+            with reaping(program):
+                rusage = wait_with_rusage(program, timeout=WAIT_TIMEOUT + 600)
+                elapsed = time.monotonic() - started
+        finally:
+            sampler.stop()
+        saved = os.path.getsize(output_path)
+        mismatch = first_mismatch(output_path, profile.payload)
+    stats = sampler.summary()
+    return dict(shaper=name, bytes=length, metaint=metaint, returncode=program.returncode,
+                saved_bytes=saved, first_mismatch=mismatch, seconds=elapsed,
+                mb_per_s=length / MB / elapsed, cpu_s_per_mb=cpu_seconds(rusage) / (length / MB),
+                read_syscalls=stats["read_syscalls"], bytes_per_read=stats["bytes_per_read"])
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--shaper", choices=sorted(SHAPERS), action="append")
+    parser.add_argument("--kilobytes", type=int, default=256)
+    parser.add_argument("--metaint", type=int, default=16)
+    options = parser.parse_args(argv)
+    report = Reporter("player_shaping", options.output)
+
+    for name in options.shaper or SHAPERS:
+        report(**run(name, options.kilobytes * 1024, options.metaint))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Throughput and backpressure of a player writing the stream to stdout.
+
+The local ICY server sends as fast as the player takes data. For each
+consumer speed (--throttle, bytes per second; 0 for unthrottled) stdout is
+drained by a StdoutCapture for --duration seconds while the player's RSS is
+sampled. A well-behaved player stalls the upstream socket when its consumer
+is slow: the server's sent bytes stay close to the captured ones and RSS
+stays flat. A player that buffers without limit shows up as RSS growth.
+"""
+import subprocess
+import time
+
+from bench import MB, Reporter, argument_parser
+from capture import StdoutCapture
+from choose_port import choose_port
+from icy_server import IcyServer, StreamProfile
+from proc_stats import ProcessSampler
+from test_player import player_context
+
+
+def run(throttle, duration):
+    with IcyServer(StreamProfile(rate=None)) as server:
+        args = (server.host, "/", str(server.port), "-", str(choose_port()), "no")
+        with player_context(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as program:
+            sampler = ProcessSampler(program, interval=0.1)
+            sampler.sample()
+            initial_rss = sampler.rss_kb
+            sampler.start()
+            capture = StdoutCapture(program.stdout, throttle=throttle or None)
+            capture.start()
+            time.sleep(duration)
+            sent, captured = server.bytes_sent, capture.bytes
+            sampler.stop()
+            alive = program.poll() is None
+
+    return dict(throttle=throttle, duration=duration, player_alive=alive,
+                captured_mb_per_s=captured / MB / duration, upstream_mb_per_s=sent / MB / duration,
+                backlog_bytes=sent - captured,
+                rss_initial_kb=initial_rss, rss_final_kb=sampler.rss_kb, rss_peak_kb=sampler.peak_rss_kb,
+                rss_growth_kb=sampler.rss_kb - initial_rss,
+                capture=capture.summary())
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--throttle", type=int, nargs="+", default=[0, 10 * MB, MB, 100 * 1024])
+    parser.add_argument("--duration", type=float, default=10)
+    options = parser.parse_args(argv)
+    report = Reporter("player_stdout", options.output)
+
+    for throttle in options.throttle:
+        report(**run(throttle, options.duration))
+
+
+if __name__ == '__main__':
+    main()
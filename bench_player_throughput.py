@@ -0,0 +1,70 @@
+"""How fast does the player move data from the stream to its output?
+
+The local ICY server sends --megabytes of audio as fast as possible and closes
+the connection; the player has to save all of it and exit. Every combination
+of icy-metaint, metadata on/off and file/stdout output is measured.
+"""
+import os
+import subprocess
+import tempfile
+import time
+
+from bench import (MB, PipeDrain, Reporter, argument_parser, cpu_seconds, reaping,
+                   wait_with_rusage)
+from choose_port import choose_port
+from common import WAIT_TIMEOUT
+from icy_server import IcyServer, StreamProfile
+from test_player import Player
+
+METAINTS = (16, 8192, 16000, 65536)
+
+
+def run_once(metaint, metadata, output, length):
+    """Stream ``length`` bytes through one player; return (seconds, cpu seconds, bytes saved)."""
+    profile = StreamProfile(metaint=metaint, rate=None, length=length, title_interval=0.001)
+    with IcyServer(profile) as server, tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, "out.mp3") if output == "file" else "-"
+        args = (server.host, "/", str(server.port), output_path, str(choose_port()),
+                "yes" if metadata else "no")
+        program = Player(args, stdout=subprocess.PIPE if output == "stdout" else subprocess.DEVNULL)
+        with reaping(program):
+            drain = PipeDrain(program.stdout) if output == "stdout" else None
+            started = time.monotonic()
+            rusage = wait_with_rusage(program, timeout=WAIT_TIMEOUT + length / MB)
+            elapsed = time.monotonic() - started
+        if drain:
+            drain.join()
+            saved = drain.bytes
+        else:
+            saved = os.path.getsize(output_path)
+    if program.returncode != 0:
+        raise RuntimeError("player exited with %d" % program.returncode)
+    return elapsed, cpu_seconds(rusage), saved
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--megabytes", type=int, default=256)
+    parser.add_argument("--metaint", type=int, action="append", help="default: %s" % (METAINTS,))
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args(argv)
+    report = Reporter("player_throughput", options.output)
+    length = options.megabytes * MB
+
+    for output in ("file", "stdout"):
+        baseline = None
+        for metaint in [None] + list(options.metaint or METAINTS):
+            metadata = metaint is not None
+            runs = [run_once(metaint or 8192, metadata, output, length) for _ in range(options.repeat)]
+            elapsed, cpu, saved = min(runs)
+            cpu_per_mb = cpu / (length / MB)
+            if not metadata:
+                baseline = cpu_per_mb
+            report(output=output, metadata=metadata, metaint=metaint, bytes=length,
+                   saved_bytes=saved, seconds=elapsed, mb_per_s=length / MB / elapsed,
+                   cpu_s_per_mb=cpu_per_mb,
+                   metadata_overhead=cpu_per_mb / baseline - 1 if metadata and baseline else None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""How long each way of stopping a player takes until the process is gone.
+
+Three paths are timed, --iterations times each:
+
+udp_quit      QUIT sent to the player's command port
+master_quit   QUIT <id> sent to a master that started the player through ssh
+              (the fake ssh in bin/, so the "remote" player runs here)
+upstream_eof  the upstream server closing the connection mid-stream
+
+Exits are noticed through a pidfd, never by polling (the player's own
+children are reaped afterwards). Every path reports a latency summary and a
+histogram (upper bucket edges in seconds); master_quit also counts the
+STARTs the master refused.
+"""
+import os
+import socket
+import subprocess
+import tempfile
+import time
+
+import fake_ssh
+from bench import Reporter, argument_parser, histogram, summary
+from choose_port import choose_port
+from common import mock_client
+from icy_server import IcyServer, StreamProfile
+from proc_stats import find_descendant
+from test_player import player_context, streamer_server
+from test_master import PLAYER_HOSTNAME, running_master
+from wait import wait_for_exit, wait_for_port, wait_until
+
+
+def udp_quit(iterations):
+    latencies, returncodes = [], []
+    with IcyServer(StreamProfile()) as server, socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _ in range(iterations):
+            port = choose_port()
+            args = (server.host, "/", str(server.port), "-", str(port), "yes")
+            with player_context(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as program:
+                started = time.monotonic()
+                sock.sendto(b"QUIT", ("127.0.0.1", port))
+                returncodes.append(wait_for_exit(program))
+                latencies.append(time.monotonic() - started)
+    return latencies, dict(returncodes=sorted(set(returncodes)))
+
+
+def upstream_eof(iterations):
+    latencies, returncodes = [], []
+    for _ in range(iterations):
+        port = choose_port()
+        args = ("127.0.0.1", "/", str(choose_port()), "-", str(port), "no")
+        with streamer_server(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as (sock, program):
+            sock.sendall(b"ICY 200 OK\r\n\r\n" + b"Z" * 4096)
+            wait_for_port(port, socket.SOCK_DGRAM, process=program)
+            started = time.monotonic()
+            sock.shutdown(socket.SHUT_RDWR)
+            sock.close()
+            returncodes.append(wait_for_exit(program))
+            latencies.append(time.monotonic() - started)
+    return latencies, dict(returncodes=sorted(set(returncodes)))
+
+
+def master_quit(iterations):
+    latencies, reply_latencies, start_errors = [], [], []
+    with tempfile.TemporaryDirectory() as directory, IcyServer(StreamProfile()) as server:
+        env = fake_ssh.environment(os.path.join(directory, "ssh.log"))
+        output = os.path.join(directory, "out.mp3")
+        with running_master(env=env) as (program, master_port), mock_client(master_port) as client:
+            for _ in range(iterations):
+                port = choose_port()
+                args = (server.host, "/", str(server.port), output, str(port), "no")
+                client.send(b"START %s %s\n" % (PLAYER_HOSTNAME, " ".join(args).encode()))
+                reply = client.readline().split()
+                if reply[:1] != [b"OK"] or len(reply) < 2:
+                    start_errors.append(b" ".join(reply).decode(errors="replace"))
+                    continue
+                player_id = reply[1]
+                pid = wait_until(lambda: find_descendant(program.pid, args))
+                wait_for_port(port, socket.SOCK_DGRAM)
+                started = time.monotonic()
+                client.send(b"QUIT %s\n" % player_id)
+                wait_for_exit(pid)
+                latencies.append(time.monotonic() - started)
+                client.readline()
+                reply_latencies.append(time.monotonic() - started)
+    return latencies, dict(reply_latency=summary(reply_latencies), start_errors=len(start_errors),
+                           start_error_replies=sorted(set(start_errors)))
+
+
+PATHS = {
+    "udp_quit": udp_quit,
+    "master_quit": master_quit,
+    "upstream_eof": upstream_eof,
+}
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--path", choices=sorted(PATHS), action="append")
+    parser.add_argument("--iterations", type=int, default=100)
+    options = parser.parse_args(argv)
+    report = Reporter("shutdown", options.output)
+
+    for name in options.path or PATHS:
+        latencies, extra = PATHS[name](options.iterations)
+        report(path=name, iterations=options.iterations, latency=summary(latencies),
+               histogram=histogram(latencies), **extra)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""How long after the stream announces a new title does TITLE report it?
+
+The local ICY server changes StreamTitle every --interval seconds and logs
+when each metadata block was sent. The benchmark polls TITLE over UDP every
+--poll seconds and records, for every title, the delay from emission to the
+first reply carrying it. Short titles and titles filling the largest metadata
+block (255 * 16 bytes) are measured separately.
+"""
+import socket
+import subprocess
+import time
+
+from bench import PipeDrain, Reporter, argument_parser, summary
+from choose_port import choose_port
+from icy_server import MAX_TITLE_SIZE, IcyServer, StreamProfile
+from test_player import player_context
+
+TITLE_SIZES = (None, MAX_TITLE_SIZE)
+
+
+def run(title_size, changes, interval, poll, metaint, rate):
+    profile = StreamProfile(metaint=metaint, rate=rate, title_interval=interval, title_size=title_size)
+    first_seen = {}
+    replies = lost = 0
+    with IcyServer(profile) as server:
+        port = choose_port()
+        args = (server.host, "/", str(server.port), "-", str(port), "yes")
+        with player_context(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as program, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            PipeDrain(program.stdout)
+            sock.settimeout(max(poll, 0.05))
+            stop_at = time.monotonic() + (changes + 1) * interval
+            while time.monotonic() < stop_at:
+                sent = time.monotonic()
+                sock.sendto(b"TITLE", ("127.0.0.1", port))
+                try:
+                    reply = sock.recv(65536)
+                except socket.timeout:
+                    lost += 1
+                    continue
+                replies += 1
+                first_seen.setdefault(reply.strip(b"'"), time.monotonic())
+                time.sleep(max(sent + poll - time.monotonic(), 0))
+        emitted = list(server.title_log)
+
+    latencies = [first_seen[title] - at for at, title in emitted if title in first_seen]
+    return dict(title_bytes=len(emitted[0][1]) if emitted else None,
+                metaint=metaint, rate=rate, poll_interval=poll,
+                titles_emitted=len(emitted), titles_seen=len(latencies),
+                latency=summary(latencies), polls=replies, polls_lost=lost)
+
+
+def main(argv=None):
+    parser = argument_parser(__doc__)
+    parser.add_argument("--changes", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between title changes")
+    parser.add_argument("--poll", type=float, default=0.005, help="seconds between TITLE requests")
+    parser.add_argument("--metaint", type=int, default=8192)
+    parser.add_argument("--rate", type=int, default=16000 * 8, help="stream bytes per second")
+    options = parser.parse_args(argv)
+    report = Reporter("title_latency", options.output)
+
+    for title_size in TITLE_SIZES:
+        report(**run(title_size, options.changes, options.interval, options.poll,
+                     options.metaint, options.rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Drain a player's stdout ("-" as the output file) and measure how it flows.
+
+StdoutCapture is a bench.PipeDrain that reads with readinto() into a
+preallocated ring buffer, so capturing costs no allocations however long the
+stream is. The last ``ring_size`` bytes stay available through tail(). With
+``throttle`` it plays a slow consumer that takes at most that many bytes per
+second.
+
+With ``record_arrivals`` every read is also logged with its time, which is
+what the PAUSE/PLAY measurements need; FileArrivals keeps the same log for an
+output file, driven by inotify.
+"""
+import bisect
+import os
+import threading
+import time
+
+from bench import PipeDrain, summary
+from common import WAIT_TIMEOUT
+from wait import Inotify, WaitTimeout
+
+
+def _deadline(timeout):
+    return time.monotonic() + (WAIT_TIMEOUT if timeout is None else timeout)
+
+
+class ArrivalLog:
+    """(time.monotonic(), total bytes) of every time output arrived, and waits on it."""
+
+    def __init__(self):
+        self.arrivals = []
+        self._changed = threading.Condition()
+
+    def _arrived(self, now, total):
+        with self._changed:
+            self.arrivals.append((now, total))
+            self._changed.notify_all()
+
+    def total_at(self, moment):
+        """Bytes that had arrived by ``moment``."""
+        with self._changed:
+            index = bisect.bisect_right(self.arrivals, (moment, float("inf")))
+            return self.arrivals[index - 1][1] if index else 0
+
+    def wait_for_arrival(self, after, timeout=None):
+        """Wait for output arriving later than ``after``; return when it came."""
+        deadline = _deadline(timeout)
+        with self._changed:
+            while not self.arrivals or self.arrivals[-1][0] <= after:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WaitTimeout("no output since %.3f" % after)
+                self._changed.wait(remaining)
+            index = bisect.bisect_right(self.arrivals, (after, float("inf")))
+            return self.arrivals[index][0]
+
+    def wait_for_quiet(self, quiet, since=0.0, timeout=None):
+        """Wait until nothing arrived for ``quiet`` seconds after ``since``.
+
+        Returns the time of the last arrival, or ``since`` if there was none after it.
+        """
+        deadline = _deadline(timeout)
+        with self._changed:
+            while True:
+                last = max(self.arrivals[-1][0], since) if self.arrivals else since
+                now = time.monotonic()
+                if now - last >= quiet:
+                    return last
+                if now >= deadline:
+                    raise WaitTimeout("output still arriving")
+                self._changed.wait(min(last + quiet, deadline) - now)
+
+
+class FileArrivals(ArrivalLog, threading.Thread):
+    """ArrivalLog of a file, sampled whenever inotify reports a change to it."""
+
+    def __init__(self, path):
+        ArrivalLog.__init__(self)
+        threading.Thread.__init__(self, daemon=True)
+        self.path = os.path.abspath(path)
+        self._watch = Inotify(os.path.dirname(self.path))
+        self._stopped = threading.Event()
+        self._size = 0
+
+    def _check(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size != self._size:
+            self._size = size
+            self._arrived(time.monotonic(), size)
+
+    def run(self):
+        name = os.path.basename(self.path)
+        self._check()
+        try:
+            while not self._stopped.is_set():
+                if name in self._watch.read(0.1):
+                    self._check()
+        finally:
+            self._watch.close()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def measure_pause_play(log, pause, play, quiet, timeout=None):
+    """Pause and resume a flowing output, timing the effect on ``log`` (an ArrivalLog).
+
+    ``pause`` and ``play`` send the commands. The output counts as stopped once
+    nothing arrived for ``quiet`` seconds.
+    """
+    log.wait_for_arrival(time.monotonic(), timeout)
+    paused_at = time.monotonic()
+    pause()
+    last_byte = log.wait_for_quiet(quiet, paused_at, timeout)
+    played_at = time.monotonic()
+    play()
+    first_byte = log.wait_for_arrival(played_at, timeout)
+    return dict(bytes_after_pause=log.total_at(last_byte) - log.total_at(paused_at),
+                pause_to_last_byte=last_byte - paused_at,
+                play_to_first_byte=first_byte - played_at)
+
+
+class StdoutCapture(ArrivalLog, PipeDrain):
+    """PipeDrain into a ring buffer that also notes stalls, a timeline and (optionally) arrivals."""
+
+    def __init__(self, pipe, ring_size=8 * 1024 * 1024, read_size=64 * 1024, throttle=None,
+                 stall_threshold=0.1, bucket=0.1, record_arrivals=False):
+        ArrivalLog.__init__(self)
+        PipeDrain.__init__(self, pipe, chunk_size=ring_size, start=False)
+        self.ring = self._buffer
+        self.read_size = min(read_size, ring_size)
+        self.throttle = throttle
+        self.stall_threshold = stall_threshold
+        self.bucket = bucket
+        self.stalls = []  # (offset from start, seconds without data) of every gap over stall_threshold
+        self.timeline = []  # bytes received in each ``bucket`` seconds since start
+        self.record_arrivals = record_arrivals
+
+    def _next_view(self):
+        position = self.bytes % len(self.ring)
+        return self._view[position:position + min(self.read_size, len(self.ring) - position)]
+
+    def _account(self, now, received):
+        if self.last_read is not None and now - self.last_read > self.stall_threshold:
+            self.stalls.append((self.last_read - self.started, now - self.last_read))
+        PipeDrain._account(self, now, received)
+        index = int((now - self.started) / self.bucket)
+        if index >= len(self.timeline):
+            self.timeline.extend([0] * (index + 1 - len(self.timeline)))
+        self.timeline[index] += received
+        if self.record_arrivals:
+            self._arrived(now, self.bytes)
+        if self.throttle:
+            delay = self.started + self.bytes / self.throttle - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def tail(self, size):
+        """The last ``size`` bytes received (at most ring_size)."""
+        size = min(size, self.bytes, len(self.ring))
+        end = self.bytes % len(self.ring)
+        if size <= end:
+            return bytes(self.ring[end - size:end])
+        return bytes(self.ring[len(self.ring) - (size - end):] + self.ring[:end])
+
+    def throughput(self):
+        """Bytes per second between the first and the latest read."""
+        if self.first_read is None or self.last_read == self.first_read:
+            return 0.0
+        return self.bytes / (self.last_read - self.first_read)
+
+    def summary(self):
+        return dict(bytes=self.bytes, bytes_per_s=self.throughput(), throttle=self.throttle,
+                    stalls=summary([seconds for _, seconds in self.stalls]),
+                    timeline_bucket=self.bucket,
+                    timeline=[count / self.bucket for count in self.timeline])
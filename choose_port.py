@@ -1,9 +1,80 @@
+import contextlib
+import errno
+import fcntl
 import itertools
+import os
+import socket
+import tempfile
 from random import randint
 
-FIRST_PORT = randint(30000, 40000)
-port_iterable = itertools.count(FIRST_PORT)
+FIRST_PORT = 30000
+LAST_PORT = 40000
+LOCK_DIR = os.path.join(tempfile.gettempdir(), "sik-tests-ports")
+
+_start = randint(FIRST_PORT, LAST_PORT - 1)
+port_iterable = itertools.chain(range(_start, LAST_PORT), range(FIRST_PORT, _start))
+
+# Lock files are kept open for the lifetime of the process, so that other
+# workers see the port as reserved until we exit (flock is released by the
+# kernel when the process dies, even on SIGKILL).
+_reserved = {}
+
+
+def _is_free(port: int) -> bool:
+    for proto in (socket.SOCK_STREAM, socket.SOCK_DGRAM):
+        with socket.socket(socket.AF_INET, proto) as s:
+            try:
+                s.bind(("", port))
+            except OSError:
+                return False
+    return True
+
+
+def _try_reserve(port: int) -> bool:
+    fd = os.open(os.path.join(LOCK_DIR, "%d.lock" % port), os.O_CREAT | os.O_RDWR, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError as e:
+        os.close(fd)
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return False
+        raise
+    if not _is_free(port):
+        os.close(fd)
+        return False
+    _reserved[port] = fd
+    return True
 
 
 def choose_port():
-    return next(port_iterable)
+    """Return a port that is free now and not handed out to any other test process."""
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    for port in port_iterable:
+        if _try_reserve(port):
+            return port
+    raise RuntimeError("no free ports left in range %d-%d" % (FIRST_PORT, LAST_PORT))
+
+
+def release_port(port: int):
+    fd = _reserved.pop(port, None)
+    if fd is not None:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def reserved_ports(count):
+    """Yield a list of ``count`` ports from choose_port() and release them afterwards."""
+    ports = []
+    try:
+        for _ in range(count):
+            ports.append(choose_port())
+        yield ports
+    finally:
+        release_ports(ports)
+
+
+def release_ports(args):
+    """Release the reserved ports among ``args`` (command line arguments or numbers)."""
+    for arg in args:
+        if str(arg).isdigit():
+            release_port(int(arg))
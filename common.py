@@ -1,9 +1,13 @@
+import collections.abc
 import contextlib
+import datetime
 import os
 import socket
 import configparser
+import select
 import time
 from choose_port import choose_port
+from icy_server import shared_server
 
 BASE_DIR = os.path.dirname(__file__)
 
@@ -14,20 +18,55 @@ WAIT_TIMEOUT = 5  # never wait longer than this and raise exception
 LONG_PAUSE = 1.5
 QUANTUM_SECONDS = 0.2
 BINARY_PATH = cp.get("tests", "binary_path")
+PROC_STATS = cp.getboolean("tests", "proc_stats", fallback=False)
+PROC_STATS_OUTPUT = os.path.join(BASE_DIR, cp.get("tests", "proc_stats_output", fallback="proc_stats.jsonl"))
+SOAK_SECONDS = cp.getfloat("tests", "soak_hours", fallback=0) * 3600
+SOAK_INTERVAL = cp.getfloat("tests", "soak_interval", fallback=10)
+SOAK_OUTPUT = os.path.join(BASE_DIR, cp.get("tests", "soak_output", fallback="soak.tsv"))
+SOAK_MAX_RSS_SLOPE = cp.getfloat("tests", "soak_max_rss_slope", fallback=1024)
+SOAK_MAX_FD_SLOPE = cp.getfloat("tests", "soak_max_fd_slope", fallback=1)
 PARAMS = 6
 
+class _LazyArgs(collections.abc.Sequence):
+    """Argument tuples built (and their ports reserved) only when an entry is used."""
+
+    def __init__(self, makers):
+        self._makers = makers
+        self._built = {}
+
+    def __len__(self):
+        return len(self._makers)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        index = range(len(self))[index]
+        if index not in self._built:
+            self._built[index] = self._makers[index]()
+        return self._built[index]
+
+
 def VALID_ARGS():
-    return [
-        ("ant-waw-01.cdn.eurozet.pl", "/", "8602", "-", str(choose_port()), "yes"),
-        ("ant-waw-01.cdn.eurozet.pl", "/", "8602", "-", str(choose_port()), "no"),
-        ("ant-waw-01.cdn.eurozet.pl", "/", "8602", "test3.mp3", str(choose_port()), "no"),
-        ("stream3.polskieradio.pl", "/", "8904", "-", str(choose_port()), "no"),
-        ("localhost", "/", str(choose_port()), "-", str(choose_port()), "no"),
-        ("localhost", "/", str(choose_port()), "-", str(choose_port()), "yes"),
-        ("localhost", "/", str(choose_port()), "test3.mp3", str(choose_port()), "no"),
-        ("localhost", "/", str(choose_port()), "test3.mp3", str(choose_port()), "yes"),
-        ("stream3.polskieradio.pl", "/", "8904", "test3.mp3", str(choose_port()), "no"),
-    ]
+    # "radio" entries point at the local stand-in for a real internet radio,
+    # "localhost" entries at a port the test serves by itself.
+    def radio(output, metadata):
+        server = shared_server()
+        return lambda: (server.host, "/", str(server.port), output, str(choose_port()), metadata)
+
+    def local(output, metadata):
+        return lambda: ("localhost", "/", str(choose_port()), output, str(choose_port()), metadata)
+
+    return _LazyArgs([
+        radio("-", "yes"),
+        radio("-", "no"),
+        radio("test3.mp3", "no"),
+        radio("-", "no"),
+        local("-", "no"),
+        local("-", "yes"),
+        local("test3.mp3", "no"),
+        local("test3.mp3", "yes"),
+        radio("test3.mp3", "no"),
+    ])
 
 INVALID_ARG_VALUES = [
     ["/", "sdfsdfa", "stream3.polskieradio."],
@@ -39,24 +78,85 @@ INVALID_ARG_VALUES = [
 ]
 
 
+def at_time_later(hours=2):
+    """AT time far enough away that the player is never started during a test or benchmark."""
+    later = datetime.datetime.now() + datetime.timedelta(hours=hours)
+    return b"%d.%02d" % (later.hour, later.minute)
+
+
 class BufferedSocket(socket.socket):
+    """Socket with line-oriented reads for the master's CRLF protocol.
+
+    Data is received straight into a preallocated chunk and appended to a
+    bytearray, so long responses are not copied over and over. Every read
+    takes an optional ``timeout`` that bounds the whole call (the socket's own
+    timeout by default), not a single recv.
+    """
+    CHUNK_SIZE = 64 * 1024
+
     def __init__(self, *args, **kwargs):
-        self._buffer = b''
+        self._buffer = bytearray()
+        self._scanned = 0  # no CRLF starts before this offset
+        self._chunk = memoryview(bytearray(self.CHUNK_SIZE))
         socket.socket.__init__(self, *args, **kwargs)
 
-    def readline(self):
-        time.sleep(QUANTUM_SECONDS) # wait a while before read
-        while b'\r\n' not in self._buffer:
-            self._buffer += self.recv(100)
-        newline_pos = self._buffer.find(b'\r\n')
-        line = self._buffer[:newline_pos]
-        self._buffer = self._buffer[newline_pos+2:]
+    def _deadline(self, timeout):
+        if timeout is None:
+            timeout = self.gettimeout()
+        return None if timeout is None else time.monotonic() + timeout
+
+    def _fill(self, deadline):
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self], [], [], remaining)[0]:
+                raise socket.timeout("timed out")
+        received = self.recv_into(self._chunk)
+        if not received:
+            raise EOFError("connection closed by peer")
+        self._buffer += self._chunk[:received]
+
+    def readline(self, timeout=None):
+        """Return the next line without its CRLF."""
+        deadline = self._deadline(timeout)
+        while True:
+            newline_pos = self._buffer.find(b'\r\n', self._scanned)
+            if newline_pos >= 0:
+                break
+            self._scanned = max(len(self._buffer) - 1, 0)
+            self._fill(deadline)
+        line = bytes(self._buffer[:newline_pos])
+        del self._buffer[:newline_pos + 2]
+        self._scanned = 0
         return line
 
+    def readlines(self, count, timeout=None):
+        """Return exactly ``count`` lines, all within one ``timeout``."""
+        deadline = self._deadline(timeout)
+        return [self.readline(None if deadline is None else max(deadline - time.monotonic(), 0))
+                for _ in range(count)]
+
+    def read(self, size, timeout=None):
+        """Return exactly ``size`` bytes, buffered lines included."""
+        deadline = self._deadline(timeout)
+        while len(self._buffer) < size:
+            self._fill(deadline)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._scanned = 0
+        return data
+
+    def __iter__(self):
+        """Yield lines until the peer closes the connection."""
+        while True:
+            try:
+                yield self.readline()
+            except EOFError:
+                return
+
 
 @contextlib.contextmanager
-def mock_client(port: int, proto=socket.SOCK_STREAM) -> BufferedSocket:
-    with contextlib.closing(BufferedSocket(socket.AF_INET, proto)) as s:
+def mock_client(port: int, proto=socket.SOCK_STREAM, socket_class=BufferedSocket) -> BufferedSocket:
+    with contextlib.closing(socket_class(socket.AF_INET, proto)) as s:
         s.settimeout(WAIT_TIMEOUT)
         s.connect(("127.0.0.1", port))
         yield s
@@ -0,0 +1,37 @@
+"""Run the master's ssh calls on this machine, without sshd or network.
+
+    with master_context(port=port, env=fake_ssh.environment(log_path)):
+        ...
+    fake_ssh.read_log(log_path)
+
+Times in the log come from CLOCK_MONOTONIC, which is shared by all processes,
+so they can be compared with time.monotonic() in the tests.
+"""
+import json
+import os
+
+from common import BASE_DIR, BINARY_PATH
+
+FAKE_SSH_DIR = os.path.join(BASE_DIR, "bin")
+
+
+def environment(log_path, delay=0, base=None):
+    """Environment for a master whose ssh runs commands locally.
+
+    Players are looked up in BINARY_PATH, as if it were on the remote PATH.
+    """
+    env = dict(os.environ if base is None else base)
+    env["PATH"] = os.pathsep.join((FAKE_SSH_DIR, os.path.abspath(BINARY_PATH), env.get("PATH", os.defpath)))
+    env["FAKE_SSH_LOG"] = log_path
+    env["FAKE_SSH_DELAY"] = str(delay)
+    return env
+
+
+def read_log(log_path, event="connect"):
+    """Logged ssh invocations (dicts with pid, host, command, time, ...) of one kind."""
+    try:
+        with open(log_path) as f:
+            records = [json.loads(line) for line in f if line.endswith("\n")]
+    except FileNotFoundError:
+        return []
+    return [record for record in records if record["event"] == event]
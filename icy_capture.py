@@ -0,0 +1,257 @@
+"""Record a real ICY stream and play it back from the local stand-in server.
+
+    python3 icy_capture.py record HOST PORT PATH capture.icy --seconds 3600
+    python3 icy_capture.py info capture.icy
+    python3 icy_capture.py replay capture.icy --port 8000 [--max-speed] [--start 600]
+
+A capture file starts with MAGIC and holds one record per piece of the
+response: a RECORD header (kind, seconds since the first byte, length)
+followed by the bytes. Kinds are HEADER (the response header, once), AUDIO and
+METADATA (a whole metadata block, length byte included), so the framing of
+the original stream is kept exactly. When the recording is finished an index
+follows the records: entries (seconds, audio offset, file offset) of audio
+records that start right after a metadata block, then a FOOTER pointing at
+them. Seeking takes one bisect over the index; captures without an index
+(an interrupted recording) are scanned once instead.
+
+Replay with ``StreamProfile(capture=Capture(path))``, see icy_server.
+"""
+import argparse
+import bisect
+import os
+import re
+import socket
+import struct
+import sys
+import time
+
+MAGIC = b"ICYCAP1\n"
+RECORD = struct.Struct("<BdI")  # kind, seconds, length
+INDEX_ENTRY = struct.Struct("<dQQ")  # seconds, audio offset, file offset
+FOOTER = struct.Struct("<QQ8s")  # index offset, entries, FOOTER_MAGIC
+FOOTER_MAGIC = b"ICYINDEX"
+HEADER, AUDIO, METADATA = 0, 1, 2
+INDEX_INTERVAL = 1.0  # seconds between index entries
+
+
+def parse_metaint(header):
+    match = re.search(rb"(?im)^icy-metaint\s*:\s*(\d+)\s*$", header)
+    return int(match.group(1)) if match else None
+
+
+def parse_title(block):
+    """StreamTitle in a metadata block (length byte included), None if there is none."""
+    match = re.search(rb"StreamTitle='(.*?)';", block[1:].rstrip(b"\0"), re.DOTALL)
+    return match.group(1) if match else None
+
+
+class CaptureWriter:
+    def __init__(self, path, index_interval=INDEX_INTERVAL):
+        self.f = open(path, "wb")
+        self.f.write(MAGIC)
+        self.index_interval = index_interval
+        self.index = []
+        self.audio_bytes = 0
+        self._metaint = None
+        self._aligned = True  # the next audio record starts a metaint period
+        self._next_entry = 0.0
+
+    def write(self, kind, seconds, data):
+        if kind == AUDIO and self._aligned and seconds >= self._next_entry:
+            self.index.append((seconds, self.audio_bytes, self.f.tell()))
+            self._next_entry = seconds + self.index_interval
+        if kind == HEADER:
+            self._metaint = parse_metaint(data)
+        elif kind == AUDIO:
+            self.audio_bytes += len(data)
+            self._aligned = not self._metaint
+        else:
+            self._aligned = True
+        self.f.write(RECORD.pack(kind, seconds, len(data)))
+        self.f.write(data)
+
+    def close(self):
+        index_offset = self.f.tell()
+        for entry in self.index:
+            self.f.write(INDEX_ENTRY.pack(*entry))
+        self.f.write(FOOTER.pack(index_offset, len(self.index), FOOTER_MAGIC))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Capture:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a capture file" % path)
+            kind, _, length = RECORD.unpack(f.read(RECORD.size))
+            if kind != HEADER:
+                raise ValueError("%s does not start with a response header" % path)
+            self.header = f.read(length)
+            self.metaint = parse_metaint(self.header)
+            self.records_end, self.index = self._read_index(f)
+
+    def _read_index(self, f):
+        size = os.fstat(f.fileno()).st_size
+        if size >= len(MAGIC) + FOOTER.size:
+            f.seek(size - FOOTER.size)
+            index_offset, count, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic == FOOTER_MAGIC:
+                f.seek(index_offset)
+                data = f.read(count * INDEX_ENTRY.size)
+                return index_offset, [entry for entry in INDEX_ENTRY.iter_unpack(data)]
+        return self._scan(f, size)
+
+    def _scan(self, f, size):
+        """Rebuild the index of a capture that was never closed."""
+        index, audio_bytes, aligned, next_entry = [], 0, True, 0.0
+        offset = len(MAGIC)
+        while offset + RECORD.size <= size:
+            f.seek(offset)
+            kind, seconds, length = RECORD.unpack(f.read(RECORD.size))
+            if offset + RECORD.size + length > size:
+                break
+            if kind == AUDIO and aligned and seconds >= next_entry:
+                index.append((seconds, audio_bytes, offset))
+                next_entry = seconds + INDEX_INTERVAL
+            if kind == AUDIO:
+                audio_bytes += length
+                aligned = not self.metaint
+            elif kind == METADATA:
+                aligned = True
+            offset += RECORD.size + length
+        return offset, index
+
+    @property
+    def duration(self):
+        """Seconds up to the last index entry, about the length of the capture."""
+        return self.index[-1][0] if self.index else 0.0
+
+    def seek(self, seconds):
+        """Index entry (seconds, audio offset, file offset) to start at for ``seconds``."""
+        if not self.index:
+            return None
+        position = bisect.bisect_right(self.index, (seconds, float("inf"), float("inf")))
+        return self.index[max(position - 1, 0)]
+
+    def records(self, start=0.0, metadata=True):
+        """Yield (kind, seconds, data) from ``start`` seconds on, at a metaint boundary."""
+        entry = self.seek(start)
+        if entry is None:
+            return
+        with open(self.path, "rb", buffering=1024 * 1024) as f:
+            f.seek(entry[2])
+            offset = entry[2]
+            while offset + RECORD.size <= self.records_end:
+                kind, seconds, length = RECORD.unpack(f.read(RECORD.size))
+                data = f.read(length)
+                if len(data) < length:
+                    return
+                offset += RECORD.size + length
+                if metadata or kind != METADATA:
+                    yield kind, seconds, data
+
+
+def record(host, port, path, output, seconds=None, audio_bytes=None, timeout=10):
+    """Capture the response to GET ``path`` until ``seconds`` or ``audio_bytes`` (or EOF)."""
+    sock = socket.create_connection((host, port), timeout=timeout)
+    request = b"GET %s HTTP/1.0\r\nHost: %s\r\nIcy-MetaData:1\r\nUser-Agent: icy_capture\r\n\r\n" % (
+        path.encode(), host.encode())
+    sock.sendall(request)
+    with sock, CaptureWriter(output) as writer:
+        buffer = b""
+        while b"\r\n\r\n" not in buffer:
+            data = sock.recv(64 * 1024)
+            if not data:
+                raise ConnectionError("connection closed before the response header ended")
+            buffer += data
+        started = time.monotonic()
+        header, _, buffer = buffer.partition(b"\r\n\r\n")
+        writer.write(HEADER, 0.0, header + b"\r\n\r\n")
+        metaint = parse_metaint(header)
+        until_metadata = metaint
+        metadata = None  # bytes of a metadata block being received
+        while True:
+            elapsed = time.monotonic() - started
+            if seconds is not None and elapsed >= seconds:
+                break
+            if audio_bytes is not None and writer.audio_bytes >= audio_bytes:
+                break
+            while buffer:
+                if metadata is not None:
+                    size = 1 + 16 * metadata[0] - len(metadata)
+                    metadata += buffer[:size]
+                    buffer = buffer[size:]
+                    if len(metadata) == 1 + 16 * metadata[0]:
+                        writer.write(METADATA, elapsed, metadata)
+                        metadata = None
+                        until_metadata = metaint
+                elif metaint and not until_metadata:
+                    metadata, buffer = buffer[:1], buffer[1:]
+                    if not metadata[0]:
+                        writer.write(METADATA, elapsed, metadata)
+                        metadata = None
+                        until_metadata = metaint
+                else:
+                    size = until_metadata if metaint else len(buffer)
+                    writer.write(AUDIO, elapsed, buffer[:size])
+                    if metaint:
+                        until_metadata -= min(size, len(buffer))
+                    buffer = buffer[size:]
+            buffer = sock.recv(64 * 1024)
+            if not buffer:
+                break
+    return writer.audio_bytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="capture a stream")
+    record_parser.add_argument("host")
+    record_parser.add_argument("port", type=int)
+    record_parser.add_argument("path")
+    record_parser.add_argument("output")
+    record_parser.add_argument("--seconds", type=float)
+    record_parser.add_argument("--megabytes", type=float)
+    info_parser = commands.add_parser("info", help="describe a capture")
+    info_parser.add_argument("capture")
+    replay_parser = commands.add_parser("replay", help="serve a capture until interrupted")
+    replay_parser.add_argument("capture")
+    replay_parser.add_argument("--host", default="127.0.0.1")
+    replay_parser.add_argument("--port", type=int, default=0)
+    replay_parser.add_argument("--max-speed", action="store_true", help="ignore the original timing")
+    replay_parser.add_argument("--start", type=float, default=0, help="seconds into the capture")
+    options = parser.parse_args(argv)
+
+    if options.command == "record":
+        audio_bytes = options.megabytes and int(options.megabytes * 1024 * 1024)
+        received = record(options.host, options.port, options.path, options.output, options.seconds, audio_bytes)
+        print("%d audio bytes" % received)
+    elif options.command == "info":
+        capture = Capture(options.capture)
+        print(capture.header.decode(errors="replace").rstrip())
+        print("metaint %s, %.1f s, %d index entries"
+              % (capture.metaint, capture.duration, len(capture.index)))
+    else:
+        from icy_server import IcyServer, StreamProfile
+        profile = StreamProfile(capture=Capture(options.capture), capture_start=options.start,
+                                capture_speed=None if options.max_speed else 1)
+        with IcyServer(profile, options.host, options.port) as server:
+            print("serving %s on %s:%d" % (options.capture, server.host, server.port))
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""Local stand-in for an ICY (Shoutcast) radio server.
+
+The server runs its own asyncio loop on a background thread, so it can be used
+from plain unittest code:
+
+    with IcyServer(StreamProfile(metaint=16, rate=None)) as server:
+        ... point players at ("127.0.0.1", server.port) ...
+
+It can also replay a recorded stream, see icy_capture.
+"""
+import asyncio
+import random
+import re
+import socket
+import threading
+import time
+import weakref
+
+from icy_capture import AUDIO, parse_title
+
+DEFAULT_TITLE = b"title of the song"
+MAX_TITLE_SIZE = 255 * 16 - len(b"StreamTitle='';")
+NOT_FOUND = b"ICY 404 Not Found\r\n\r\n"
+
+
+def metadata_block(title):
+    """Return the length byte followed by the padded StreamTitle for ``title``."""
+    if title is None:
+        return b"\x00"
+    text = b"StreamTitle='%s';" % title
+    blocks = -(-len(text) // 16)
+    if blocks > 255:
+        raise ValueError("title too long for one metadata block")
+    return bytes([blocks]) + text.ljust(blocks * 16, b"\x00")
+
+
+class StreamProfile:
+    """What the stand-in server sends to every client.
+
+    path            the only path served; requests for others get NOT_FOUND
+    status_line     first line of the response
+    headers         extra (name, value) header pairs
+    metaint         audio bytes between metadata blocks; metadata is only sent
+                    to clients asking for it with Icy-MetaData:1 (None or 0
+                    disables it for everyone)
+    rate            audio bytes per second, None for as fast as possible
+    payload         audio pattern, repeated forever
+    title           StreamTitle; with title_interval it gets a counter appended
+    title_interval  seconds between title changes, None for a constant title
+    title_size      pad every title with "-" to this many bytes (4065 fills the
+                    largest metadata block, 255 * 16 bytes)
+    length          audio bytes to send before closing, None for endless
+    capture         an icy_capture.Capture to replay instead; only the fields
+                    below apply then
+    capture_start   seconds into the capture to start at (the nearest metadata
+                    boundary before it)
+    capture_speed   1 keeps the recorded timing, 2 plays twice as fast, None
+                    sends as fast as possible
+    """
+
+    def __init__(self, *, path=b"/", status_line=b"ICY 200 OK", headers=(), metaint=8192, rate=16000,
+                 payload=b"Z", title=DEFAULT_TITLE, title_interval=None, title_size=None, length=None,
+                 capture=None, capture_start=0, capture_speed=1):
+        self.path = path
+        self.status_line = status_line
+        self.headers = tuple(headers)
+        self.metaint = metaint
+        self.rate = rate
+        self.payload = payload
+        self.title = title
+        self.title_interval = title_interval
+        self.title_size = title_size
+        self.length = length
+        self.capture = capture
+        self.capture_start = capture_start
+        self.capture_speed = capture_speed
+
+    def replace(self, **changes):
+        values = dict(vars(self))
+        values.update(changes)
+        return StreamProfile(**values)
+
+
+class Shaper:
+    """Makes the stand-in server behave like a real network.
+
+    max_segment     largest piece handed to the socket at once (1: byte by byte)
+    random_segments pick every piece size at random from 1..max_segment
+    split_metadata  always cut metadata after its length byte and inside the title
+    bandwidth       bytes per second per connection, None for unlimited
+    latency         seconds to wait before every piece, plus up to ``jitter`` more
+    """
+
+    def __init__(self, *, max_segment=None, random_segments=False, split_metadata=False,
+                 bandwidth=None, latency=0, jitter=0, seed=None):
+        self.max_segment = max_segment
+        self.random_segments = random_segments
+        self.split_metadata = split_metadata
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self._sent = weakref.WeakKeyDictionary()  # writer -> (start time, bytes sent)
+
+    def pieces(self, data, kind):
+        if kind == "metadata" and self.split_metadata and len(data) > 1:
+            middle = 1 + (len(data) - 1) // 2
+            cuts = [data[:1], data[1:middle], data[middle:]]
+        else:
+            cuts = [data]
+        for cut in cuts:
+            offset = 0
+            while offset < len(cut):
+                size = len(cut) - offset
+                if self.max_segment:
+                    size = min(size, self.random.randint(1, self.max_segment)
+                               if self.random_segments else self.max_segment)
+                yield cut[offset:offset + size]
+                offset += size
+
+    async def send(self, writer, data, kind):
+        started, sent = self._sent.get(writer, (time.monotonic(), 0))
+        for piece in self.pieces(data, kind):
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                await asyncio.sleep(delay)
+            writer.write(piece)
+            await writer.drain()
+            sent += len(piece)
+            if self.bandwidth:
+                delay = started + sent / self.bandwidth - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        self._sent[writer] = (started, sent)
+
+
+class PatternSource:
+    """Hands out consecutive slices of an endlessly repeated pattern."""
+
+    def __init__(self, pattern, chunk_size=64 * 1024):
+        repeats = -(-chunk_size // len(pattern)) + 1
+        self._buffer = memoryview(pattern * repeats)
+        self._period = len(pattern)
+        self._chunk_size = chunk_size
+        self._offset = 0
+
+    def take(self, size):
+        size = min(size, self._chunk_size)
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset = (self._offset + size) % self._period
+        return data
+
+
+class IcyServer:
+    def __init__(self, profile=None, host="127.0.0.1", port=0, shaper=None):
+        self.profile = profile or StreamProfile()
+        self.shaper = shaper
+        self.host = host
+        self.port = port
+        self.clients = 0  # currently connected
+        self.connections = 0  # accepted so far
+        self.bytes_sent = 0
+        self.title_log = []  # (time.monotonic(), title) of every title sent
+        self.requests = []  # raw request headers, in order of arrival
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait()
+        if self._server is None:
+            raise OSError("could not listen on %s:%d" % (self.host, self.port))
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(
+                self._handle, self.host, self.port, reuse_address=True, backlog=1024))
+            self.port = self._server.sockets[0].getsockname()[1]
+        finally:
+            ready.set()
+        if self._server is None:
+            return
+        self._loop.run_forever()
+        self._server.close()
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.close()
+
+    def response_header(self, metaint):
+        if self.profile.capture is not None:
+            header = self.profile.capture.header
+            if not metaint:
+                header = re.sub(rb"(?im)^icy-metaint\s*:.*\r\n", b"", header)
+            return header
+        lines = [self.profile.status_line]
+        lines += [b"%s:%s" % (name, value) for name, value in self.profile.headers]
+        if metaint:
+            lines.append(b"icy-metaint:%d" % metaint)
+        return b"\r\n".join(lines) + b"\r\n\r\n"
+
+    async def send(self, writer, data, kind="audio"):
+        """Write one piece ("header", "audio" or "metadata") of the response."""
+        if self.shaper is not None:
+            await self.shaper.send(writer, data, kind)
+            return
+        writer.write(data)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self.clients += 1
+        self.connections += 1
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            self.requests.append(request)
+            request_line = request.split(b"\r\n", 1)[0].split()
+            if len(request_line) < 2 or request_line[1] != self.profile.path:
+                await self.send(writer, NOT_FOUND, "header")
+                return
+            wants_metadata = b"icy-metadata:1" in request.lower().replace(b" ", b"")
+            if self.profile.capture is not None:
+                metaint = self.profile.capture.metaint if wants_metadata else None
+                await self.send(writer, self.response_header(metaint), "header")
+                await self._replay(writer, wants_metadata)
+            else:
+                metaint = self.profile.metaint if wants_metadata else None
+                await self.send(writer, self.response_header(metaint), "header")
+                await self._stream(writer, metaint)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    async def _stream(self, writer, metaint):
+        profile = self.profile
+        source = PatternSource(profile.payload)
+        block = metaint or 64 * 1024
+        if profile.rate:
+            block = min(block, max(profile.rate // 50, 1))  # keep bursts around 20 ms
+        started = time.monotonic()
+        audio_sent = 0
+        until_metadata = metaint
+        title_number = 0
+        next_title_change = started
+
+        while profile.length is None or audio_sent < profile.length:
+            size = block
+            if metaint:
+                size = min(size, until_metadata)
+            if profile.length is not None:
+                size = min(size, profile.length - audio_sent)
+            data = source.take(size)
+            await self.send(writer, data)
+            audio_sent += len(data)
+            self.bytes_sent += len(data)
+
+            if metaint:
+                until_metadata -= len(data)
+                if not until_metadata:
+                    until_metadata = metaint
+                    title = None
+                    now = time.monotonic()
+                    if now >= next_title_change:
+                        title = profile.title
+                        if profile.title_interval:
+                            title_number += 1
+                            title = b"%s %d" % (profile.title, title_number)
+                            next_title_change = now + profile.title_interval
+                        else:
+                            next_title_change = float("inf")
+                        if profile.title_size:
+                            title = title.ljust(profile.title_size, b"-")
+                        self.title_log.append((now, title))
+                    await self.send(writer, metadata_block(title), "metadata")
+
+            if profile.rate:
+                delay = started + audio_sent / profile.rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+    async def _replay(self, writer, metadata):
+        profile = self.profile
+        started = time.monotonic()
+        first = None
+        for kind, seconds, data in profile.capture.records(profile.capture_start, metadata):
+            if first is None:
+                first = seconds
+            if profile.capture_speed:
+                delay = started + (seconds - first) / profile.capture_speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self.send(writer, data, "audio" if kind == AUDIO else "metadata")
+            if kind == AUDIO:
+                self.bytes_sent += len(data)
+            else:
+                title = parse_title(data)
+                if title is not None:
+                    self.title_log.append((time.monotonic(), title))
+
+
+# Roughly what a 128 kbit/s internet radio looks like.
+RADIO_PROFILE = StreamProfile(metaint=8192, rate=16000, title_interval=1)
+
+_shared_server = None
+
+
+def shared_server():
+    """Return the process-wide RADIO_PROFILE server, started on first use."""
+    global _shared_server
+    if _shared_server is None:
+        _shared_server = IcyServer(RADIO_PROFILE).start()
+    return _shared_server
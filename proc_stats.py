@@ -0,0 +1,203 @@
+"""Resource usage of spawned player and master processes, sampled from /proc.
+
+Enable with ``proc_stats = yes`` in config.cfg. Every Player and Master is
+then watched by a ProcessSampler and test classes using ProcStatsMixin append
+one JSON line per test to ``proc_stats_output``.
+"""
+import json
+import os
+import threading
+import time
+
+import results
+from common import PROC_STATS, PROC_STATS_OUTPUT
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+DEFAULT_INTERVAL = 0.05
+
+active = []  # samplers started since the last collect()
+
+
+def read_status(pid):
+    """Fields of /proc/<pid>/status we care about, sizes in kB."""
+    fields = {}
+    with open("/proc/%d/status" % pid) as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "VmHWM", "Threads", "voluntary_ctxt_switches",
+                        "nonvoluntary_ctxt_switches"):
+                fields[name] = int(value.split()[0])
+    return fields
+
+
+def read_cpu_seconds(pid):
+    with open("/proc/%d/stat" % pid) as f:
+        # the command name may contain spaces, fields are counted after it
+        fields = f.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def read_io(pid):
+    with open("/proc/%d/io" % pid) as f:
+        return {name: int(value) for name, value in (line.split(":") for line in f)}
+
+
+def count_fds(pid):
+    return len(os.listdir("/proc/%d/fd" % pid))
+
+
+def read_cmdline(pid):
+    with open("/proc/%d/cmdline" % pid, "rb") as f:
+        return [arg.decode() for arg in f.read().split(b"\0")[:-1]]
+
+
+def descendants(pid):
+    """Pids of all processes below ``pid``, children before grandchildren."""
+    found, queue = [], [pid]
+    while queue:
+        parent = queue.pop(0)
+        try:
+            tasks = os.listdir("/proc/%d/task" % parent)
+        except FileNotFoundError:
+            continue
+        for task in tasks:
+            try:
+                with open("/proc/%d/task/%s/children" % (parent, task)) as f:
+                    children = [int(child) for child in f.read().split()]
+            except FileNotFoundError:
+                continue
+            found += children
+            queue += children
+    return found
+
+
+def find_processes(args, pids=None):
+    """Pids of processes (of ``pids``, all by default) whose command line ends with ``args``."""
+    if pids is None:
+        pids = [int(entry) for entry in os.listdir("/proc") if entry.isdigit()]
+    found = []
+    for pid in pids:
+        try:
+            if tuple(read_cmdline(pid)[-len(args):]) == tuple(args):
+                found.append(pid)
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            pass
+    return found
+
+
+def find_descendant(pid, args):
+    """Pid of a process below ``pid`` whose command line ends with ``args``, or None."""
+    found = find_processes(args, descendants(pid))
+    return found[0] if found else None
+
+
+class ProcessSampler(threading.Thread):
+    def __init__(self, process, interval=DEFAULT_INTERVAL, name=None):
+        super().__init__(daemon=True)
+        self.process = process
+        self.pid = process.pid
+        self.interval = interval
+        self.label = name or os.path.basename(str(process.args[0]))
+        self.samples = 0
+        self.peak_rss_kb = 0
+        self.rss_kb = 0
+        self.cpu_seconds = 0.0
+        self.fds = 0
+        self.peak_fds = 0
+        self.io = {}
+        self.ctxt_switches = 0
+        self.shared = False  # outlives the test that started it, see collect()
+        self._stopped = threading.Event()
+
+    def sample(self):
+        """Take one sample; return False once the process is gone."""
+        try:
+            status = read_status(self.pid)
+            self.cpu_seconds = read_cpu_seconds(self.pid)
+            self.io = read_io(self.pid)
+            self.fds = count_fds(self.pid)
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return False
+        self.rss_kb = status.get("VmRSS", 0)
+        self.peak_rss_kb = max(self.peak_rss_kb, status.get("VmHWM", 0), self.rss_kb)
+        self.peak_fds = max(self.peak_fds, self.fds)
+        self.ctxt_switches = (status.get("voluntary_ctxt_switches", 0)
+                              + status.get("nonvoluntary_ctxt_switches", 0))
+        self.samples += 1
+        return True
+
+    def run(self):
+        while not self._stopped.is_set() and self.process.returncode is None and self.sample():
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def reset_peaks(self):
+        self.peak_rss_kb = self.rss_kb
+        self.peak_fds = self.fds
+
+    def summary(self):
+        rchar, wchar = self.io.get("rchar", 0), self.io.get("wchar", 0)
+        syscr, syscw = self.io.get("syscr", 0), self.io.get("syscw", 0)
+        return dict(process=self.label, pid=self.pid, samples=self.samples,
+                    peak_rss_kb=self.peak_rss_kb, rss_kb=self.rss_kb,
+                    cpu_seconds=self.cpu_seconds, fds=self.fds, peak_fds=self.peak_fds,
+                    ctxt_switches=self.ctxt_switches,
+                    read_bytes=rchar, write_bytes=wchar, read_syscalls=syscr, write_syscalls=syscw,
+                    bytes_per_read=rchar / syscr if syscr else None,
+                    bytes_per_write=wchar / syscw if syscw else None)
+
+
+def watch(process, interval=DEFAULT_INTERVAL):
+    """Start sampling ``process`` (a Popen) and return the sampler."""
+    if not PROC_STATS:
+        return None
+    sampler = ProcessSampler(process, interval)
+    sampler.sample()
+    sampler.start()
+    active.append(sampler)
+    return sampler
+
+
+def collect():
+    """Return the summaries of all samplers started so far and stop them.
+
+    Shared samplers (of a process serving a whole TestCase class) take a fresh
+    sample instead and keep running, their peaks restarting from there.
+    """
+    summaries, kept = [], []
+    while active:
+        sampler = active.pop(0)
+        if sampler.shared and sampler.is_alive() and sampler.sample():
+            summaries.append(sampler.summary())
+            sampler.reset_peaks()
+            kept.append(sampler)
+        else:
+            sampler.stop()
+            summaries.append(sampler.summary())
+    active.extend(kept)
+    return summaries
+
+
+def unwatch(sampler):
+    """Stop ``sampler`` without reporting it."""
+    if sampler in active:
+        active.remove(sampler)
+    sampler.stop()
+
+
+class ProcStatsMixin:
+    """Append the resource usage of processes spawned by each test to a JSON lines file."""
+    proc_stats_output = PROC_STATS_OUTPUT
+
+    def tearDown(self):
+        super().tearDown()
+        summaries = collect()
+        self.proc_stats = summaries
+        if summaries and self.proc_stats_output:
+            with open(self.proc_stats_output, "a") as f:
+                print(json.dumps(dict(test=self.id(), time=time.time(), processes=summaries)), file=f)
+        for process in summaries:
+            results.store(dict(benchmark="proc_stats", test=self.id(), time=time.time(), **process))
@@ -0,0 +1,252 @@
+"""Keep benchmark results per build and find regressions between builds.
+
+Every Reporter record (and every proc_stats summary) is appended to the JSON
+lines file ``results_store`` together with the build it measured: SHA-256 of
+the player and master binaries, the host name and a digest of the rest of
+config.cfg. Then
+
+    python3 results.py builds
+    python3 results.py compare OLD NEW
+
+lists the recorded builds, and compares two of them. A build is given by a
+prefix of its player or master digest, or by player:PREFIX or master:PREFIX
+when only one of the binaries changed; a prefix naming more than one build
+is refused. Measurements are grouped by benchmark and by its
+command line parameters (PARAMETERS); a metric counts as regressed when the
+Mann-Whitney U test finds the builds different at --alpha and the median got
+worse by more than --threshold. Run a benchmark a few times per build, single
+runs can't be tested.
+"""
+import argparse
+import collections
+import functools
+import hashlib
+import json
+import math
+import os
+import re
+import socket
+import sys
+
+from common import BASE_DIR, BINARY_PATH, cp
+
+RESULTS_STORE = cp.get("tests", "results_store", fallback="")
+RESULTS_STORE = RESULTS_STORE and os.path.join(BASE_DIR, RESULTS_STORE)
+
+LOWER_IS_BETTER = re.compile(r"latency|rss|cpu|fds|switches|_to_|drift|stalls|stale|lost|timeouts|failed")
+HIGHER_IS_BETTER = re.compile(r"per_s$|throughput")
+# per benchmark, the fields that come from its command line: results are only
+# compared with results measured the same way. Everything else a record holds
+# is an outcome of the run, which must not split the comparison.
+PARAMETERS = {
+    "master_at": ("entries", "minutes", "duration"),
+    "master_connections": ("target",),
+    "master_crash": ("players", "wave", "spacing"),
+    "master_load": ("concurrency", "target_rate"),
+    "master_pipeline": ("count", "mode"),
+    "master_spawn": ("players", "connections", "command", "ssh_delay"),
+    "pause_play": ("mode", "cycles", "quiet", "rate", "metaint"),
+    "player_commands": ("flood_rate", "flood", "title_probes"),
+    "player_fanout": ("players", "sink", "rate"),
+    "player_shaping": ("shaper", "bytes", "metaint"),
+    "player_stdout": ("throttle", "duration"),
+    "player_throughput": ("output", "metadata", "metaint", "bytes"),
+    "proc_stats": ("test", "process"),
+    "shutdown": ("path", "iterations"),
+    "title_latency": ("title_bytes", "metaint", "rate", "poll_interval"),
+}
+SUMMARY_FIELDS = ("p50", "p99", "mean", "max")
+
+
+@functools.lru_cache(maxsize=None)
+def file_sha256(path):
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def build():
+    """What a result was measured on."""
+    settings = sorted((name, value) for name, value in cp.items("tests") if name != "binary_path")
+    return dict(player=file_sha256(os.path.join(BINARY_PATH, "player")),
+                master=file_sha256(os.path.join(BINARY_PATH, "master")),
+                host=socket.gethostname(),
+                config=hashlib.sha256(json.dumps(settings).encode()).hexdigest()[:16])
+
+
+def store(record, path=None):
+    """Append ``record`` with its build to the store (if there is one)."""
+    path = path or RESULTS_STORE
+    if not path:
+        return
+    line = json.dumps(dict(record, build=build()), sort_keys=True) + "\n"
+    # one write(2) on an O_APPEND file, so parallel test processes don't interleave
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+def load(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.endswith("\n")]
+
+
+def metrics(record):
+    """{name: (value, higher_is_better)} of the comparable numbers in ``record``."""
+    found = {}
+    for name, value in record.items():
+        if isinstance(value, dict) and set(SUMMARY_FIELDS) <= set(value):
+            leaves = [("%s.%s" % (name, field), value[field]) for field in SUMMARY_FIELDS]
+        else:
+            leaves = [(name, value)]
+        for leaf, number in leaves:
+            if isinstance(number, bool) or not isinstance(number, (int, float)):
+                continue
+            if LOWER_IS_BETTER.search(leaf):
+                found[leaf] = (number, False)
+            elif HIGHER_IS_BETTER.search(leaf):
+                found[leaf] = (number, True)
+    return found
+
+
+def parameters(record):
+    """The fields telling what was measured, as a hashable key."""
+    return tuple((name, record.get(name)) for name in sorted(PARAMETERS.get(record.get("benchmark"), ())))
+
+
+def build_key(record):
+    build = record.get("build", {})
+    return build.get("player"), build.get("master")
+
+
+def matches(record, spec, host):
+    """Does ``record`` come from a build ``spec`` ([player:|master:]PREFIX) names?"""
+    binary, _, prefix = spec.rpartition(":")
+    if binary not in ("", "player", "master"):
+        raise ValueError("%r: only player: or master: may come before the prefix" % spec)
+    build = record.get("build", {})
+    return (host is None or build.get("host") == host) and any(
+        (build.get(name) or "").startswith(prefix) for name in ((binary,) if binary else ("player", "master")))
+
+
+def find_build(records, spec, host=None):
+    """(player, master) digests of the one build ``spec`` names; ValueError unless there is exactly one."""
+    found = {build_key(record) for record in records if matches(record, spec, host)}
+    if len(found) != 1:
+        raise ValueError("%r matches %d builds, give more of the digest or prefix it with player: or master:"
+                         % (spec, len(found)))
+    return found.pop()
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def mann_whitney_p(first, second):
+    """Two-sided p-value of the Mann-Whitney U test, normal approximation with tie correction."""
+    ranked = sorted([(value, 0) for value in first] + [(value, 1) for value in second])
+    ranks = [0.0] * len(ranked)
+    ties = 0.0
+    start = 0
+    while start < len(ranked):
+        end = start
+        while end + 1 < len(ranked) and ranked[end + 1][0] == ranked[start][0]:
+            end += 1
+        for i in range(start, end + 1):
+            ranks[i] = (start + end) / 2 + 1
+        size = end - start + 1
+        ties += size ** 3 - size
+        start = end + 1
+    n1, n2 = len(first), len(second)
+    u = sum(rank for rank, (_, group) in zip(ranks, ranked) if group == 0) - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)
+    return math.erfc(max(z, 0) / math.sqrt(2))
+
+
+def compare(records, old, new, host=None, alpha=0.05, threshold=0.05, min_samples=3):
+    """Yield a dict for every metric measured often enough on both builds."""
+    builds = (find_build(records, old, host), find_build(records, new, host))
+    if builds[0] == builds[1]:
+        raise ValueError("%r and %r name the same build" % (old, new))
+    samples = collections.defaultdict(lambda: ([], []))
+    for record in records:
+        for side, build in enumerate(builds):
+            if build_key(record) == build and (host is None or record["build"].get("host") == host):
+                key = (record.get("benchmark"), record["build"].get("config"), parameters(record))
+                for name, (value, higher_is_better) in metrics(record).items():
+                    samples[key + (name, higher_is_better)][side].append(value)
+
+    for (benchmark, config, params, name, higher_is_better), (before, after) in sorted(samples.items(), key=str):
+        if len(before) < min_samples or len(after) < min_samples:
+            continue
+        old_median, new_median = median(before), median(after)
+        change = (new_median - old_median) / abs(old_median) if old_median else 0.0
+        worse = -change if higher_is_better else change
+        p = mann_whitney_p(before, after)
+        yield dict(benchmark=benchmark, parameters=dict(params), metric=name,
+                   old=old_median, new=new_median, change=change, p=p,
+                   samples=(len(before), len(after)),
+                   regression=p < alpha and worse > threshold,
+                   improvement=p < alpha and -worse > threshold)
+
+
+def print_builds(records):
+    seen = collections.Counter()
+    for record in records:
+        build = record.get("build", {})
+        seen[(build.get("player"), build.get("master"), build.get("host"), build.get("config"))] += 1
+    for (player, master, host, config), count in sorted(seen.items(), key=str):
+        print("player %s  master %s  host %s  config %s  %d results"
+              % ((player or "-")[:12], (master or "-")[:12], host, config, count))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", default=RESULTS_STORE, help="results file (results_store in config.cfg)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("builds", help="list the builds with results")
+    compare_parser = commands.add_parser("compare", help="report regressions of NEW against OLD")
+    compare_parser.add_argument("old", metavar="OLD", help="[player:|master:]prefix of the old SHA-256")
+    compare_parser.add_argument("new", metavar="NEW", help="[player:|master:]prefix of the new SHA-256")
+    compare_parser.add_argument("--host", default=socket.gethostname(), help="'' for results of any host")
+    compare_parser.add_argument("--alpha", type=float, default=0.05)
+    compare_parser.add_argument("--threshold", type=float, default=0.05, help="smallest relative change reported")
+    compare_parser.add_argument("--min-samples", type=int, default=3)
+    compare_parser.add_argument("--all", action="store_true", help="print every compared metric")
+    options = parser.parse_args(argv)
+
+    if not options.store or not os.path.exists(options.store):
+        parser.error("no results in %r" % options.store)
+    records = load(options.store)
+    if options.command == "builds":
+        print_builds(records)
+        return 0
+
+    regressions = 0
+    try:
+        for result in compare(records, options.old, options.new, options.host or None,
+                              options.alpha, options.threshold, options.min_samples):
+            regressions += result["regression"]
+            if options.all or result["regression"]:
+                print(json.dumps(result, sort_keys=True))
+    except ValueError as e:
+        parser.error(str(e))
+    print("%d regressions" % regressions, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""Run TestCase classes from the given modules on a pool of worker processes.
+
+    python3 run_parallel.py [-j JOBS] [module ...]
+
+Classes with ``SERIAL = True`` inspect system-wide state (pidof, killall) and
+are run one after another once the pool has finished.
+"""
+import argparse
+import importlib
+import io
+import multiprocessing
+import sys
+import unittest
+
+DEFAULT_MODULES = ("test_player", "test_master", "test_results")
+
+
+def collect_classes(module_names):
+    classes = []
+    for module_name in module_names:
+        module = importlib.import_module(module_name)
+        for name in dir(module):
+            obj = getattr(module, name)
+            if (isinstance(obj, type) and issubclass(obj, unittest.TestCase)
+                    and obj.__module__ == module.__name__):
+                classes.append("%s.%s" % (module_name, name))
+    return classes
+
+
+def run_class(qualname):
+    module_name, class_name = qualname.rsplit(".", 1)
+    module = importlib.import_module(module_name)
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(getattr(module, class_name))
+    stream = io.StringIO()
+    result = unittest.TextTestRunner(stream=stream, verbosity=0).run(suite)
+    return (qualname, result.testsRun, len(result.failures), len(result.errors),
+            len(result.skipped), stream.getvalue())
+
+
+def is_serial(qualname):
+    module_name, class_name = qualname.rsplit(".", 1)
+    return getattr(getattr(importlib.import_module(module_name), class_name), "SERIAL", False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    options = parser.parse_args(argv)
+
+    classes = collect_classes(options.modules)
+    parallel = [c for c in classes if not is_serial(c)]
+    serial = [c for c in classes if is_serial(c)]
+
+    with multiprocessing.Pool(options.jobs) as pool:
+        results = list(pool.imap_unordered(run_class, parallel))
+    results += [run_class(c) for c in serial]
+
+    failed = False
+    for qualname, run, failures, errors, skipped, output in sorted(results):
+        print("%-40s run=%d failures=%d errors=%d skipped=%d" % (qualname, run, failures, errors, skipped))
+        if failures or errors:
+            failed = True
+            print(output)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Long runs that look for slow leaks.
+
+Enable with ``soak_hours`` in config.cfg. A soak test keeps its players busy
+for that long while a Soak samples RSS and open fds of every watched process
+each ``soak_interval`` seconds. Samples are appended to ``soak_output`` as tab
+separated lines (seconds since start, process, RSS in kB, fds) and only the
+running sums of a least-squares fit are kept in memory, so a run of days
+costs nothing but disk.
+"""
+import os
+import time
+
+from common import (SOAK_INTERVAL, SOAK_MAX_FD_SLOPE, SOAK_MAX_RSS_SLOPE,
+                    SOAK_OUTPUT, SOAK_SECONDS)
+from proc_stats import count_fds, read_status
+
+WARMUP = 0.1  # part of the run left out of the trend, while buffers and caches fill up
+
+
+class ProcessExited(AssertionError):
+    """A watched process died during the soak."""
+
+
+def exit_status(process):
+    """None while ``process`` (a Popen or pid) runs; its exit code, or "unknown" for a bare pid."""
+    if hasattr(process, "poll"):
+        return process.poll()
+    try:
+        with open("/proc/%d/stat" % process) as f:
+            state = f.read().rpartition(")")[2].split()[0]
+    except (FileNotFoundError, ProcessLookupError):
+        return "unknown"
+    return "unknown" if state in ("Z", "X") else None
+
+
+class Trend:
+    """Least-squares line through (x, y) points, fed one point at a time."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+
+    def add(self, x, y):
+        self.count += 1
+        self.sum_x += x
+        self.sum_y += y
+        self.sum_xx += x * x
+        self.sum_xy += x * y
+
+    def slope(self):
+        denominator = self.count * self.sum_xx - self.sum_x ** 2
+        if self.count < 2 or denominator == 0:
+            return 0.0
+        return (self.count * self.sum_xy - self.sum_x * self.sum_y) / denominator
+
+
+class Soak:
+    """Run ``actions`` over and over for ``duration`` seconds while sampling ``processes``.
+
+    ``processes`` maps a label to a Popen or pid, ``actions`` are callables
+    taking no arguments, run one after another each interval.
+    """
+
+    def __init__(self, processes, actions=(), duration=SOAK_SECONDS, interval=SOAK_INTERVAL,
+                 output=SOAK_OUTPUT):
+        self.processes = processes
+        self.actions = actions
+        self.duration = duration
+        self.interval = interval
+        self.output = output
+        self.trends = {}  # (label, "rss_kb" or "fds") -> Trend over hours
+        self.samples = 0
+
+    def _check_alive(self, label, process, elapsed):
+        status = exit_status(process)
+        if status is not None:
+            raise ProcessExited("%s (pid %d) exited with status %s %.0f s into the soak"
+                                % (label, getattr(process, "pid", process), status, elapsed))
+
+    def _sample(self, elapsed, f):
+        for label, process in self.processes.items():
+            pid = getattr(process, "pid", process)
+            self._check_alive(label, process, elapsed)
+            try:
+                rss_kb = read_status(pid).get("VmRSS", 0)
+                fds = count_fds(pid)
+            except (FileNotFoundError, ProcessLookupError):
+                self._check_alive(label, process, elapsed)
+                raise
+            print("%.1f\t%s\t%d\t%d" % (elapsed, label, rss_kb, fds), file=f)
+            if elapsed >= self.duration * WARMUP:
+                self.trends.setdefault((label, "rss_kb"), Trend()).add(elapsed / 3600, rss_kb)
+                self.trends.setdefault((label, "fds"), Trend()).add(elapsed / 3600, fds)
+        f.flush()
+        self.samples += 1
+
+    def run(self):
+        """Soak; return {(label, measure): slope per hour}."""
+        started = time.monotonic()
+        with open(self.output, "a") as f:
+            print("# %s %s" % (time.strftime("%Y-%m-%dT%H:%M:%S"), " ".join(sorted(self.processes))), file=f)
+            while True:
+                elapsed = time.monotonic() - started
+                self._sample(elapsed, f)
+                if elapsed >= self.duration:
+                    break
+                for action in self.actions:
+                    action()
+                time.sleep(max(started + self.samples * self.interval - time.monotonic(), 0))
+        return {key: trend.slope() for key, trend in self.trends.items()}
+
+
+class SoakMixin:
+    max_slopes = {"rss_kb": SOAK_MAX_RSS_SLOPE, "fds": SOAK_MAX_FD_SLOPE}
+
+    def assertNoGrowth(self, slopes):
+        for (label, measure), slope in sorted(slopes.items()):
+            with self.subTest(process=label, measure=measure):
+                self.assertLessEqual(slope, self.max_slopes[measure],
+                                     "%s %s grows by %.2f per hour, see %s"
+                                     % (label, measure, slope, os.path.relpath(SOAK_OUTPUT)))
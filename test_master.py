@@ -1,26 +1,44 @@
-
+import collections
 import contextlib
+import functools
+import itertools
 import os
+import signal
+import socket
 import subprocess
+import tempfile
 import time
 import unittest
 import datetime
 from random import randint
 
-from choose_port import choose_port
-from common import mock_client, QUANTUM_SECONDS, BINARY_PATH, VALID_ARGS, LONG_PAUSE
+import fake_ssh
+import proc_stats
+from arg_matrix import check_exit_failure, run_cases
+from choose_port import choose_port, release_ports
+from common import (at_time_later, mock_client, BufferedSocket, LONG_PAUSE, QUANTUM_SECONDS, BINARY_PATH,
+                    SOAK_SECONDS, VALID_ARGS)
+from icy_server import IcyServer, StreamProfile
+from proc_stats import ProcStatsMixin
+from soak import Soak, SoakMixin
+from wait import (wait_for_file_growth, wait_for_file_stable, wait_for_port,
+                  wait_for_readable, wait_until)
 
 PLAYER_HOSTNAME = b"localhost"
 MASTER_PATH = os.path.join(BINARY_PATH, "master")
 SKIP_LONG_TESTS = False
 
+INVALID_ARGS = [(port,) for port in ("0", "-1", "65536", "99999", "234asdf", "12345" * 10, "ciastka")]
+INVALID_ARGS += [("234", "234"), ("234", ""), ("234", "234", "234")]
+
 
 class Master(subprocess.Popen):
-    def __init__(self, args=(), port=None, *, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL):
+    def __init__(self, args=(), port=None, *, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=None):
         if port is not None:
             assert args == ()
             args = (str(port),)
-        super().__init__((MASTER_PATH,) + args, stdout=stdout, stderr=stderr)
+        super().__init__((MASTER_PATH,) + args, stdout=stdout, stderr=stderr, env=env)
+        self.stats = proc_stats.watch(self)
 
 
 @contextlib.contextmanager
@@ -31,20 +49,169 @@ def master_context(*args, **kwargs):
     finally:
         program.kill()
         program.wait()
+        release_ports(program.args[1:])
 
-@contextlib.contextmanager
-def master_and_mock_client():
-    port = choose_port()
-    with master_context(port=port):
-        time.sleep(QUANTUM_SECONDS)
-        with mock_client(port) as client:
-            yield client
+def players_running():
+    return subprocess.call(["pidof", "player"], stdout=subprocess.DEVNULL) == 0
 
 
-class TestArguments(unittest.TestCase):
+@contextlib.contextmanager
+def running_master(**kwargs):
+    """Start a master on a fresh port and yield (program, port) once it listens."""
+    port = choose_port()
+    with master_context(port=port, **kwargs) as program:
+        wait_for_port(port, process=program)
+        yield program, port
+
+
+def insert_telnet_sequences(args, sequences=(b"\xff\xfe\x06", b"\xff\xf5", b"\xff\xf7")):
+    last_idx = 0
+    for seq in sequences:
+        index = randint(last_idx, len(args))
+        args = args[0:index] + seq + args[index:]
+        last_idx = index + len(seq)
+    return args
+
+
+def pipelined_commands(count):
+    """``count`` command lines in one buffer and, for each, whether OK is expected.
+
+    AT commands (some with telnet sequences in their arguments) get OK with a
+    fresh id, bogus commands get ERROR. No player is started.
+    """
+    args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
+    at = at_time_later()
+    lines, expect_ok = [], []
+    for i in range(count):
+        if i % 3 == 2:
+            lines.append(b"WRONG_COMMAND %d\n" % i)
+            expect_ok.append(False)
+        else:
+            line_args = insert_telnet_sequences(args) if i % 3 == 1 else args
+            lines.append(b"AT %s 1 %s %s\n" % (at, PLAYER_HOSTNAME, line_args))
+            expect_ok.append(True)
+    return b"".join(lines), expect_ok
+
+
+def send_in_segments(sock, data, max_segment=7, pause=0.0005):
+    """Send ``data`` in small pieces so that lines are split across TCP segments."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    offset = 0
+    while offset < len(data):
+        size = randint(1, max_segment)
+        sock.sendall(data[offset:offset + size])
+        offset += size
+        if pause:
+            time.sleep(pause)
+
+
+class TrackingSocket(BufferedSocket):
+    """Control connection that remembers the ids of players started through it."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.awaiting = collections.deque()  # per command sent: does its reply carry a new id?
+        self.player_ids = []
+        self.player_args = []  # command line arguments of every START and AT sent
+        self._partial = b''
+
+    def _track(self, data):
+        lines = (self._partial + bytes(data)).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            fields = line.split()
+            if fields:
+                self.awaiting.append(fields[0] in (b"START", b"AT"))
+            if fields[:1] == [b"START"] or fields[:1] == [b"AT"]:
+                self.player_args.append(tuple(arg.decode(errors="replace")
+                                              for arg in fields[2 if fields[0] == b"START" else 4:]))
+
+    def send(self, data, *args):
+        sent = super().send(data, *args)
+        self._track(data[:sent])
+        return sent
+
+    def sendall(self, data, *args):
+        super().sendall(data, *args)
+        self._track(data)
+
+    def readline(self, timeout=None):
+        line = super().readline(timeout)
+        if self.awaiting and self.awaiting.popleft():
+            split = line.split()
+            if len(split) == 2 and split[0] == b"OK":
+                self.player_ids.append(split[1])
+        return line
+
+
+class SharedMaster:
+    """One master for a whole TestCase class, restarted when a test breaks it."""
+
+    def __init__(self):
+        self.program = None
+        self.port = None
+        self.player_args = []  # of the players started through this master, to find orphans
+        self._stack = None
+
+    def start(self):
+        self._stack = contextlib.ExitStack()
+        self.program, self.port = self._stack.enter_context(running_master())
+        if self.program.stats:
+            self.program.stats.shared = True
+
+    def stop(self):
+        """Kill the master and every player it started that is still around."""
+        if self._stack is None:
+            return
+        if self.program.stats:
+            proc_stats.unwatch(self.program.stats)
+        orphans = set(proc_stats.descendants(self.program.pid))
+        self._stack.close()
+        self._stack = None
+        for args in self.player_args:
+            if args:
+                orphans.update(proc_stats.find_processes(args))
+        self.player_args = []
+        for pid in orphans:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def healthy(self):
+        """Is the master running and still answering (with ERROR) to a bogus command?"""
+        if self.program is None or self.program.poll() is not None:
+            return False
+        try:
+            with mock_client(self.port) as client:
+                client.send(b"HEALTH_CHECK\n")
+                return client.readline(timeout=QUANTUM_SECONDS * 5).startswith(b"ERROR")
+        except (OSError, EOFError):
+            return False
+
+    def ensure_healthy(self):
+        if not self.healthy():
+            self.stop()
+            self.start()
+
+    def quit_players(self, player_ids):
+        """QUIT players a test left behind; False if the master did not answer."""
+        if not player_ids:
+            return True
+        try:
+            with mock_client(self.port) as client:
+                for player_id in player_ids:
+                    client.send(b"QUIT %s\n" % player_id)
+                client.readlines(len(player_ids))
+        except (OSError, EOFError):
+            return False
+        return True
+
+
+class TestArguments(ProcStatsMixin, unittest.TestCase):
     def test_no_parameters(self):
         with master_context((), stdout=subprocess.PIPE) as program:
-            time.sleep(QUANTUM_SECONDS)
+            wait_for_readable(program.stdout)
         line = program.stdout.readline()
         self.assertTrue(line)
         self.assertNotIn(b"0", line.split())
@@ -55,38 +222,46 @@ class TestArguments(unittest.TestCase):
         line = program.stdout.readline()
         self.assertEqual(line, b'')
 
-    def test_zero(self):
-        with master_context(("0",), stderr=subprocess.PIPE) as program:
-            line = program.communicate(timeout=QUANTUM_SECONDS)[1]
-            self.assertTrue(line)
-            self.assertEqual(program.wait(timeout=QUANTUM_SECONDS), 1)
-
-    def test_wrong_number(self):
-        with master_context(("234", "234"), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as program:
-            line = program.communicate(timeout=QUANTUM_SECONDS)[1]
-            self.assertTrue(line)
-            self.assertEqual(program.wait(timeout=QUANTUM_SECONDS), 1)
-
-    def test_not_a_number_suffix(self):
-        with master_context(("234asdf",), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as program:
-            line = program.communicate(timeout=QUANTUM_SECONDS)[1]
-            self.assertTrue(line)
-            self.assertEqual(program.wait(timeout=QUANTUM_SECONDS), 1)
-
-    def test_number_too_long(self):
-        with master_context(("12345" * 10,), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as program:
-            line = program.communicate(timeout=QUANTUM_SECONDS)[1]
-            self.assertTrue(line)
-            self.assertEqual(program.wait(timeout=QUANTUM_SECONDS), 1)
-
-    def test_not_a_number_at_all(self):
-        with master_context(("ciastka",), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as program:
-            line = program.communicate(timeout=QUANTUM_SECONDS)[1]
-            self.assertTrue(line)
-            self.assertEqual(program.wait(timeout=QUANTUM_SECONDS), 1)
-
-
-class TestCommands(unittest.TestCase):
+    def test_invalid_arguments(self):
+        for args, error in run_cases(INVALID_ARGS, functools.partial(check_exit_failure, master_context)):
+            with self.subTest(args=args):
+                self.fail("%s: %s" % (type(error).__name__, error))
+
+
+class TestCommands(ProcStatsMixin, unittest.TestCase):
+    SERIAL = True  # test_quit and test_client_crash look at every player on the host
+
+    @classmethod
+    def setUpClass(cls):
+        cls.master = SharedMaster()
+        cls.master.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.master.stop()
+
+    def setUp(self):
+        super().setUp()
+        self.master.ensure_healthy()
+        self.clients = []
+
+    def tearDown(self):
+        player_ids = [player_id for client in self.clients for player_id in client.player_ids]
+        self.master.player_args += [args for client in self.clients for args in client.player_args]
+        if not self.master.quit_players(player_ids):
+            self.master.stop()  # setUp of the next test starts a fresh one
+        for client in self.clients:
+            for args in client.player_args:
+                release_ports(args)
+        super().tearDown()
+
+    @contextlib.contextmanager
+    def mock_client(self):
+        """Control connection to the shared master; its players are QUIT after the test."""
+        with mock_client(self.master.port, socket_class=TrackingSocket) as client:
+            self.clients.append(client)
+            yield client
+
     def assertOK(self, line):
         split = line.split()
         self.assertEqual(len(split), 2)
@@ -94,7 +269,7 @@ class TestCommands(unittest.TestCase):
         return split[1]
 
     def test_wrong_command(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             client.send(b"WRONG_COMMAND\n")
             line = client.readline()
             self.assertIn(b"ERROR", line)
@@ -104,93 +279,110 @@ class TestCommands(unittest.TestCase):
             self.assertIn(b"ERROR", line)
 
     def test_start_wrong_host(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             client.send(b"START definitely_nonexistent 1 2 3 4 5 6\n")
             line = client.readline()
             self.assertIn(b"ERROR", line)
 
     def test_start(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"START %s %s\n" % (PLAYER_HOSTNAME, args))
             self.assertOK(client.readline())
 
     def test_start_with_large_spaces(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes("     ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"START   %s   %s\n" % (PLAYER_HOSTNAME, args))
             self.assertOK(client.readline())
 
     def test_quit(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes("     ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"START   %s   %s\n" % (PLAYER_HOSTNAME, args))
             player_id = self.assertOK(client.readline())
             client.send(b"QUIT %s\n" % player_id)
-            time.sleep(QUANTUM_SECONDS)
-            self.assertEqual(subprocess.check_output(["pidof", "player"]), b"")
+            wait_until(lambda: not players_running(), message="player still running after QUIT")
 
     def test_telnet_control_sequences(self):
-        sequences = (b"\xff\xfe\x06", b"\xff\xf5", b"\xff\xf7")
-        with master_and_mock_client() as client:
-            args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
-            last_idx = 0
-            for seq in sequences:
-                index = randint(last_idx, len(args))
-                args = args[0:index] + seq + args[index:]
-                last_idx = index + len(seq)
+        with self.mock_client() as client:
+            args = insert_telnet_sequences(bytes(" ".join(VALID_ARGS()[8]), "utf-8"))
             client.send(b"START %s %s\n" % (PLAYER_HOSTNAME, args))
             player_id = self.assertOK(client.readline())
 
+    def assertPipelinedReplies(self, client, expect_ok):
+        replies = client.readlines(len(expect_ok))
+        ids = []
+        for i, (reply, ok) in enumerate(zip(replies, expect_ok)):
+            if ok:
+                ids.append(self.assertOK(reply))
+            else:
+                self.assertTrue(reply.startswith(b"ERROR"), "reply %d: %r" % (i, reply))
+        self.assertEqual(len(set(ids)), len(ids), "player ids repeated")
+        with self.assertRaises(socket.timeout):
+            client.readline(timeout=QUANTUM_SECONDS)  # exactly one reply per command
+
+    def test_pipelined_commands(self):
+        data, expect_ok = pipelined_commands(300)
+        with self.mock_client() as client:
+            client.sendall(data)
+            self.assertPipelinedReplies(client, expect_ok)
+
+    def test_pipelined_commands_split_across_segments(self):
+        data, expect_ok = pipelined_commands(100)
+        with self.mock_client() as client:
+            send_in_segments(client, data)
+            self.assertPipelinedReplies(client, expect_ok)
+
     @unittest.skipIf(PLAYER_HOSTNAME != b"localhost", "Requires execution on localhost")
     def test_client_crash(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"START %s %s\n" % (PLAYER_HOSTNAME, args))
             player_id = self.assertOK(client.readline())
-            time.sleep(QUANTUM_SECONDS)
+            wait_until(players_running, message="player has not been started")
             self.assertEqual(subprocess.call(["killall", "player"]), 0)
             line = client.readline()
             self.assertTrue(line.startswith(b"ERROR %s" % player_id))
 
     def test_at_command(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"AT 21.12 100 %s %s\n" % (PLAYER_HOSTNAME, args))
             self.assertOK(client.readline())
 
     def test_at_negative_duration(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"AT 21.12 -1 %s %s\n" % (PLAYER_HOSTNAME, args))
             self.assertTrue(client.readline().startswith(b"ERROR"))
 
     def test_at_invalid_time(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"AT 24.12 10 %s %s\n" % (PLAYER_HOSTNAME, args))
             self.assertTrue(client.readline().startswith(b"ERROR"))
 
     def test_at_invalid_time2(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"AT 1.62 10 %s %s\n" % (PLAYER_HOSTNAME, args))
             self.assertTrue(client.readline().startswith(b"ERROR"))
 
     def test_at_invalid_time3(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"AT a1.32 10 %s %s\n" % (PLAYER_HOSTNAME, args))
             self.assertTrue(client.readline().startswith(b"ERROR"))
 
     def test_at_invalid_time4(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"AT 1:22 10 %s %s\n" % (PLAYER_HOSTNAME, args))
             self.assertTrue(client.readline().startswith(b"ERROR"))
 
     def test_at_invalid_time5(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             args = bytes(" ".join(VALID_ARGS()[8]), "utf-8")
             client.send(b"AT 1.a22 10 %s %s\n" % (PLAYER_HOSTNAME, args))
             self.assertTrue(client.readline().startswith(b"ERROR"))
@@ -198,7 +390,7 @@ class TestCommands(unittest.TestCase):
     @unittest.skipIf(SKIP_LONG_TESTS, "Long test")
     @unittest.skipIf(PLAYER_HOSTNAME != b"localhost", "Requires execution on localhost")
     def test_at(self):
-        with master_and_mock_client() as client:
+        with self.mock_client() as client:
             arg_list = VALID_ARGS()[8]
             output_path = os.path.expanduser(os.path.join("~", arg_list[3]))
             if os.path.exists(output_path):
@@ -231,51 +423,45 @@ class TestCommands(unittest.TestCase):
             self.assertTrue(os.path.exists(output_path))
 
             # Check it's filling up
-            initial_size = os.path.getsize(output_path)
-            time.sleep(LONG_PAUSE)
-            size = os.path.getsize(output_path)
-            self.assertTrue(size > initial_size)
+            wait_for_file_growth(output_path)
 
             # Check PAUSE works
             client.send(b"PAUSE %s\n" % player_id)
-            time.sleep(QUANTUM_SECONDS)
             self.assertEqual(self.assertOK(client.readline()), player_id)
-            initial_size= os.path.getsize(output_path)
-            time.sleep(LONG_PAUSE)
-            size = os.path.getsize(output_path)
-            self.assertEqual(size, initial_size)
+            wait_for_file_stable(output_path, LONG_PAUSE)
 
             # Check PLAY works
-            initial_size = os.path.getsize(output_path)
             client.send(b"PLAY %s\n" % player_id)
-            time.sleep(LONG_PAUSE)
             self.assertEqual(self.assertOK(client.readline()), player_id)
-            size = os.path.getsize(output_path)
-            self.assertTrue(size > initial_size)
+            wait_for_file_growth(output_path)
 
             # Check QUIT works
-            initial_size = os.path.getsize(output_path)
             client.send(b"QUIT %s\n" % player_id)
             self.assertEqual(self.assertOK(client.readline()), player_id)
-            time.sleep(LONG_PAUSE)
-            self.assertEqual(subprocess.check_output(["pidof", "player"]), b"")
+            wait_until(lambda: not players_running(), message="player still running after QUIT")
 
 
-class TestIntegration(unittest.TestCase):
+class TestIntegration(ProcStatsMixin, unittest.TestCase):
 
     def test_start(self):
         port = choose_port()
-        with master_context(port=port):
-            time.sleep(QUANTUM_SECONDS)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        log_path = os.path.join(directory.name, "ssh.log")
+        with master_context(port=port, env=fake_ssh.environment(log_path)) as program:
+            wait_for_port(port, process=program)
             with mock_client(port) as client:
                 client.send(b"START %s p1 p2 p3 p4 p5 p6\n" % PLAYER_HOSTNAME)
                 text = client.readline()
+                invocation = wait_until(lambda: fake_ssh.read_log(log_path))[0]
+                self.assertEqual(invocation["host"], PLAYER_HOSTNAME.decode())
+                self.assertIn("player", invocation["command"])
+                self.assertIn("p1 p2 p3 p4 p5 p6", invocation["command"])
                 # Not finished yet
                 # ok, num_str = text.strip().split()
                 # self.assertEqual(ok, b"OK")
                 # client_num = int(num_str)
                 # time.sleep(QUANTUM_SECONDS)
-                # # TODO: assert that ssh was executed with correct parameters
                 # # TODO: assert that the client is still running
                 # client.send(b"QUIT %d\n" % client_num)
                 # time.sleep(QUANTUM_SECONDS)
@@ -284,6 +470,34 @@ class TestIntegration(unittest.TestCase):
                 # # TODO: assert that the client has been stopped
 
 
+@unittest.skipUnless(SOAK_SECONDS, "soak_hours is 0 in config.cfg")
+class TestSoak(SoakMixin, ProcStatsMixin, unittest.TestCase):
+    def test_soak(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        env = fake_ssh.environment(os.path.join(directory.name, "ssh.log"))
+        with IcyServer(StreamProfile(title_interval=1)) as server, \
+                running_master(env=env) as (program, port):
+            args = (server.host, "/", str(server.port), os.devnull, str(choose_port()), "yes")
+            with mock_client(port) as client:
+                client.send(b"START %s %s\n" % (PLAYER_HOSTNAME, " ".join(args).encode()))
+                ok, player_id = client.readline().split()
+                self.assertEqual(ok, b"OK")
+            player = wait_until(lambda: proc_stats.find_descendant(program.pid, args))
+            commands = itertools.cycle((b"PAUSE", b"PLAY"))
+
+            def reconnect():
+                # a fresh control connection every time, the master must not keep anything of the old ones
+                with mock_client(port) as client:
+                    client.send(b"%s %s\n" % (next(commands), player_id))
+                    self.assertTrue(client.readline().startswith(b"OK"))
+                    client.send(b"TITLE %s\n" % player_id)
+                    self.assertTrue(client.readline().startswith(b"OK"))
+
+            soak = Soak(dict(master=program, player=player), (reconnect,))
+            self.assertNoGrowth(soak.run())
+
+
 if __name__ == '__main__':
     if PLAYER_HOSTNAME != b"localhost":
         print("========================================")
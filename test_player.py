@@ -1,30 +1,54 @@
 import contextlib
+import functools
+import itertools
 import os
 import random
 import socket
 import string
 import struct
 import subprocess
+import tempfile
 import time
 import unittest
 
-from choose_port import choose_port
+import icy_capture
+import proc_stats
+from arg_matrix import check_exit_failure, invalid_argument_cases, run_cases, wrong_count_cases
+from bench import PipeDrain
+from capture import FileArrivals, StdoutCapture, measure_pause_play
+from choose_port import choose_port, release_ports
 from common import (BINARY_PATH, INVALID_ARG_VALUES, LONG_PAUSE, PARAMS,
-                    QUANTUM_SECONDS, VALID_ARGS, WAIT_TIMEOUT)
+                    QUANTUM_SECONDS, SOAK_SECONDS, VALID_ARGS, WAIT_TIMEOUT)
+from icy_server import IcyServer, Shaper, StreamProfile
+from proc_stats import ProcStatsMixin
+from soak import Soak, SoakMixin
+from verify import first_mismatch
+from wait import (WaitTimeout, wait_for_exit, wait_for_file_size, wait_for_port,
+                  wait_for_readable)
 
 PLAYER_PATH = os.path.join(BINARY_PATH, "player")
 
 class Player(subprocess.Popen):
     def __init__(self, args=(), *, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL):
         super().__init__((PLAYER_PATH,) + args, stdout=stdout, stderr=stderr)
+        self.stats = proc_stats.watch(self)
+
+
+def command_port(params):
+    """UDP port the player should listen on, or None if the arguments are bogus."""
+    if len(params) != PARAMS or not params[4].isdigit() or not 0 < int(params[4]) < 65536:
+        return None
+    return int(params[4])
 
 
 @contextlib.contextmanager
-def player_context(*args, **kwargs):
+def player_context(*args, wait_ready=True, **kwargs):
     program = Player(*args, **kwargs)
-    time.sleep(QUANTUM_SECONDS)
 
     try:
+        port = command_port(args[0]) if args else None
+        if wait_ready and port is not None:
+            wait_for_port(port, socket.SOCK_DGRAM, process=program)
         yield program
     finally:
         try:
@@ -32,6 +56,7 @@ def player_context(*args, **kwargs):
             program.wait()
         except:
             pass
+        release_ports(program.args[1:])
 
 @contextlib.contextmanager
 def streamer_server(*args, **kwargs):
@@ -39,18 +64,81 @@ def streamer_server(*args, **kwargs):
     server_sock.bind((args[0][0], int(args[0][2])))
     server_sock.listen(1)
 
-    with player_context(*args, **kwargs) as program:
+    # the player connects before it opens the command port, accept() is our sync point
+    with player_context(*args, wait_ready=False, **kwargs) as program:
         client_sock, client_addr = server_sock.accept()
 
         try:
             yield (client_sock, program)
         finally:
             client_sock.close()
+            server_sock.close()
 
-    server_sock.close()
+@contextlib.contextmanager
+def players_context(args_list, wait_ready=True, **kwargs):
+    """Like player_context for many players: all are started before any is waited for."""
+    programs = []
+    try:
+        for args in args_list:
+            programs.append(Player(args, **kwargs))
+        if wait_ready:
+            for args, program in zip(args_list, programs):
+                port = command_port(args)
+                if port is not None:
+                    wait_for_port(port, socket.SOCK_DGRAM, process=program)
+        yield programs
+    finally:
+        for program in programs:
+            try:
+                program.kill()
+            except:
+                pass
+        for program in programs:
+            program.wait()
+            release_ports(program.args[1:])
 
 
-class TestArguments(unittest.TestCase):
+@contextlib.contextmanager
+def icy_streamer(*args, profile=None, shaper=None, **kwargs):
+    """Like streamer_server, but a local IcyServer streams ``profile`` by itself.
+
+    The server accepts any number of clients, so further players can be
+    pointed at the same host and port.
+    """
+    with IcyServer(profile, args[0][0], int(args[0][2]), shaper) as server:
+        with player_context(*args, **kwargs) as program:
+            yield (server, program)
+
+
+def wait_for_title(sock, port, expected=None):
+    """Ask for TITLE until the reply is non-empty (or one of ``expected``).
+
+    Returns the last (data, address) reply, even if the wait timed out, so the
+    caller can assert on it.
+    """
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while True:
+        sock.sendto(b'TITLE', ('127.0.0.1', port))
+        wait_for_readable(sock)
+        response = sock.recvfrom(100)
+        done = response[0] in expected if expected else response[0]
+        if done or time.monotonic() >= deadline:
+            return response
+        time.sleep(QUANTUM_SECONDS / 4)
+
+
+def with_fresh_port(args, port=None):
+    """Give concurrently started players their own command port, unless it is the bad value.
+
+    The port replaced is released; the new one is released by the player's context.
+    """
+    if len(args) > 4 and (port is None or args[4] == port):
+        release_ports(args[4:5])
+        args = args[:4] + (str(choose_port()),) + args[5:]
+    return args
+
+
+class TestArguments(ProcStatsMixin, unittest.TestCase):
     def assertExitFailure(self, program, message=None):
         line = program.communicate(timeout=QUANTUM_SECONDS)[1]
         self.assertTrue(line)
@@ -65,29 +153,21 @@ class TestArguments(unittest.TestCase):
         with player_context((), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as program:
             self.assertExitFailure(program)
 
-    def test_wrong_number_of_parameters(self):
-        for num in range(1, PARAMS):
-            tmp_parameters = tuple(VALID_ARGS()[0][0:num])
-            with player_context(tmp_parameters, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as program:
-                self.assertExitFailure(program)
+    def assertAllExitFailure(self, cases):
+        """Run the player with every argument tuple at once; report each failure on its own."""
+        for args, error in run_cases(cases, functools.partial(check_exit_failure, player_context)):
+            with self.subTest(args=args):
+                self.fail("%s: %s" % (type(error).__name__, error))
 
-        for num in range(PARAMS + 1, PARAMS + 3):
-            tmp_parameters = tuple(VALID_ARGS()[0][0:PARAMS]) + tuple(["0"] * (num - PARAMS))
-            with player_context(tmp_parameters, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as program:
-                self.assertExitFailure(program)
+    def test_wrong_number_of_parameters(self):
+        self.assertAllExitFailure([with_fresh_port(args) for args in wrong_count_cases(VALID_ARGS()[0])])
 
     def test_wrong_parameters(self):
-        valid_parameters = list(VALID_ARGS()[0])
-
-        for num in range(0, PARAMS):
-            for wrong_param in INVALID_ARG_VALUES[num]:
-                tmp_parameters = valid_parameters.copy()
-                tmp_parameters[num] = wrong_param
-
-                with player_context(tuple(tmp_parameters), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as program:
-                    self.assertExitFailure(program, tmp_parameters)
+        valid_parameters = VALID_ARGS()[0]
+        cases = invalid_argument_cases(valid_parameters, INVALID_ARG_VALUES)
+        self.assertAllExitFailure([with_fresh_port(args, valid_parameters[4]) for args in cases])
 
-class TestCommands(unittest.TestCase):
+class TestCommands(ProcStatsMixin, unittest.TestCase):
     def test_quit_command(self):
         valid_parameters = VALID_ARGS()[1]
 
@@ -97,22 +177,16 @@ class TestCommands(unittest.TestCase):
             sock.sendto(b'QUIT', ('localhost', int(valid_parameters[4])))
             sock.close()
 
-            self.assertEqual(program.wait(timeout=QUANTUM_SECONDS), 0)
+            self.assertEqual(wait_for_exit(program), 0)
 
 
     def test_title_command(self):
         valid_parameters = VALID_ARGS()[0]
 
         with player_context(valid_parameters, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as program:
-            time.sleep(LONG_PAUSE)
-
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             sock.settimeout(WAIT_TIMEOUT)
-            sock.sendto(b'TITLE', ('127.0.0.1', int(valid_parameters[4])))
-
-            time.sleep(QUANTUM_SECONDS)
-
-            response = sock.recvfrom(100)
+            response = wait_for_title(sock, int(valid_parameters[4]))
             sock.close()
 
             self.assertTrue(response[0])
@@ -137,18 +211,38 @@ class TestCommands(unittest.TestCase):
                 sock.send(b'Z' * 16)
                 sock.send(b'\x00')
 
-            time.sleep(LONG_PAUSE)
-
             command_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            command_sock.sendto(b'TITLE', ('127.0.0.1', int(valid_parameters[4])))
+            response = wait_for_title(command_sock, int(valid_parameters[4]),
+                                      [b"title of the song", b"'title of the song'"])
+            command_sock.close()
 
-            time.sleep(LONG_PAUSE)
+            self.assertIn(response[0], [b"title of the song", b"'title of the song'"])
 
-            response = command_sock.recvfrom(100)
+    def test_title_command_with_fragmented_stream(self):
+        valid_parameters = VALID_ARGS()[5]
+        profile = StreamProfile(metaint=16, rate=None)
+        shaper = Shaper(max_segment=1, split_metadata=True)
+        with icy_streamer(valid_parameters, profile=profile, shaper=shaper,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as (server, program):
+            command_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            response = wait_for_title(command_sock, int(valid_parameters[4]),
+                                      [b"title of the song", b"'title of the song'"])
             command_sock.close()
 
             self.assertIn(response[0], [b"title of the song", b"'title of the song'"])
 
+    def test_title_command_with_many_players(self):
+        valid_parameters = VALID_ARGS()[5]
+        args_list = [with_fresh_port(valid_parameters) for _ in range(8)]
+        with IcyServer(None, valid_parameters[0], int(valid_parameters[2])), \
+                players_context(args_list, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL), \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as command_sock:
+            command_sock.settimeout(WAIT_TIMEOUT)
+            for args in args_list:
+                response = wait_for_title(command_sock, int(args[4]),
+                                          [b"title of the song", b"'title of the song'"])
+                self.assertIn(response[0], [b"title of the song", b"'title of the song'"])
+
     def test_no_meta_data(self):
         valid_parameters = VALID_ARGS()[1]
 
@@ -192,7 +286,7 @@ class TestCommands(unittest.TestCase):
                 self.assertEqual(program.wait(timeout=QUANTUM_SECONDS), 0)
 
 
-class TestBehaviour(unittest.TestCase):
+class TestBehaviour(ProcStatsMixin, unittest.TestCase):
     def assertExitFailure(self, program):
         line = program.communicate(timeout=QUANTUM_SECONDS)[1]
         self.assertTrue(line)
@@ -200,46 +294,51 @@ class TestBehaviour(unittest.TestCase):
 
 
     def assertAllZ(self, filename):
-        with open(filename, 'r') as f:
-            self.assertEqual(len(f.read().replace('Z', '')), 0)
+        mismatch = first_mismatch(filename, b'Z')
+        self.assertIsNone(mismatch, "unexpected byte at offset %s" % mismatch)
+
+
+    def assertPausePlay(self, log, port):
+        """PAUSE has to stop the output in ``log`` and PLAY restart it.
 
+        Output counts as stopped after LONG_PAUSE without any, well above the
+        gaps of a flowing stream; how fast it happens is bench_pause_play's business.
+        """
+        address = ('127.0.0.1', port)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            try:
+                return measure_pause_play(log, lambda: sock.sendto(b'PAUSE', address),
+                                          lambda: sock.sendto(b'PLAY', address), LONG_PAUSE)
+            except WaitTimeout as e:
+                self.fail("output did not stop after PAUSE and restart after PLAY: %s" % e)
 
     def test_play_pause_command(self):
         valid_parameters = VALID_ARGS()[2]
 
         with player_context(valid_parameters, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as program:
-            # check if file is filling up
-            size = os.path.getsize(valid_parameters[3])
-            time.sleep(QUANTUM_SECONDS)
-            self.assertNotEqual(size, os.path.getsize(valid_parameters[3]))
-
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.sendto(b'PAUSE', ('127.0.0.1', int(valid_parameters[4])))
-            time.sleep(QUANTUM_SECONDS) # wait for player to parse command
-
-            # check if file has stopped filling up
-            size = os.path.getsize(valid_parameters[3])
-            time.sleep(QUANTUM_SECONDS)
-            self.assertEqual(size, os.path.getsize(valid_parameters[3]))
-
-            sock.sendto(b'PLAY', ('127.0.0.1', int(valid_parameters[4])))
-            time.sleep(QUANTUM_SECONDS) # wait for player to parse command
-
-            # check if file is filling up again
-            size = os.path.getsize(valid_parameters[3])
-            time.sleep(QUANTUM_SECONDS)
-            self.assertNotEqual(size, os.path.getsize(valid_parameters[3]))
-
-            sock.close()
+            log = FileArrivals(valid_parameters[3])
+            log.start()
+            try:
+                self.assertPausePlay(log, int(valid_parameters[4]))
+            finally:
+                log.stop()
 
             program.kill()
             program.wait()
             os.remove(valid_parameters[3])
 
+    def test_play_pause_command_stdout(self):
+        valid_parameters = VALID_ARGS()[1]
+
+        with player_context(valid_parameters, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as program:
+            log = StdoutCapture(program.stdout, record_arrivals=True)
+            log.start()
+            self.assertPausePlay(log, int(valid_parameters[4]))
+
     def test_timeout_response(self):
         valid_parameters = VALID_ARGS()[4]
         with streamer_server(valid_parameters, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as (sock, program):
-            time.sleep(WAIT_TIMEOUT)
+            wait_for_exit(program, WAIT_TIMEOUT + QUANTUM_SECONDS)
             self.assertExitFailure(program)
 
     def test_invalid_response_streamer(self):
@@ -258,7 +357,7 @@ class TestBehaviour(unittest.TestCase):
             for _ in range(0, 1000):
                 sock.send(b'Z' * 16)
 
-            time.sleep(LONG_PAUSE) # flush can take a while :C
+            wait_for_file_size(valid_parameters[3], 16000) # flush can take a while :C
             self.assertEqual(os.path.getsize(valid_parameters[3]), 16000)
             self.assertAllZ(valid_parameters[3])
 
@@ -274,7 +373,7 @@ class TestBehaviour(unittest.TestCase):
             for _ in range(0, 1000):
                 sock.send(((b'Z' * 16) + (b'\x00')))
 
-            time.sleep(LONG_PAUSE)
+            wait_for_file_size(valid_parameters[3], 16 * 1000)
             self.assertEqual(os.path.getsize(valid_parameters[3]), 16 * 1000)
             self.assertAllZ(valid_parameters[3])
 
@@ -291,12 +390,32 @@ class TestBehaviour(unittest.TestCase):
             for _ in range(0, 1000):
                 sock.send(((b'Z' * 16) + (b'\x02') + b"StreamTitle='title of the song';"))
 
-            time.sleep(LONG_PAUSE)
+            wait_for_file_size(valid_parameters[3], 16 * 1000)
             self.assertEqual(os.path.getsize(valid_parameters[3]), 16 * 1000)
             self.assertAllZ(valid_parameters[3])
 
             os.remove(valid_parameters[3])
 
+    def test_saving_data_from_replayed_capture(self):
+        valid_parameters = VALID_ARGS()[7]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        capture_path = os.path.join(directory.name, "stream.icy")
+        profile = StreamProfile(metaint=100, rate=None, payload=bytes(range(256)), length=50000,
+                                title_interval=0.001)
+        with IcyServer(profile) as server:
+            icy_capture.record(server.host, server.port, "/", capture_path)
+        capture = icy_capture.Capture(capture_path)
+        audio = b"".join(data for kind, _, data in capture.records() if kind == icy_capture.AUDIO)
+
+        with icy_streamer(valid_parameters, profile=StreamProfile(capture=capture, capture_speed=None),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL):
+            wait_for_file_size(valid_parameters[3], len(audio))
+            with open(valid_parameters[3], "rb") as f:
+                self.assertEqual(f.read(), audio)
+
+            os.remove(valid_parameters[3])
+
     def test_server_close_connection_when_header(self):
         valid_parameters = VALID_ARGS()[5]
         with streamer_server(valid_parameters, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as (sock, program):
@@ -312,7 +431,7 @@ class TestBehaviour(unittest.TestCase):
             sock.send(b'Z' * 12)
 
             sock.shutdown(socket.SHUT_WR)
-            self.assertEqual(program.wait(timeout=QUANTUM_SECONDS), 0)
+            self.assertEqual(wait_for_exit(program), 0)
 
     def test_server_close_connection_when_metadata(self):
         valid_parameters = VALID_ARGS()[5]
@@ -325,13 +444,13 @@ class TestBehaviour(unittest.TestCase):
             sock.send(b"StreamTitle='title of the song';")
 
             sock.shutdown(socket.SHUT_WR)
-            self.assertEqual(program.wait(timeout=QUANTUM_SECONDS), 0)
+            self.assertEqual(wait_for_exit(program), 0)
 
 
     def test_timeout_when_header(self):
         valid_parameters = VALID_ARGS()[5]
         with streamer_server(valid_parameters, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as (sock, program):
-            time.sleep(WAIT_TIMEOUT)
+            wait_for_exit(program, WAIT_TIMEOUT + QUANTUM_SECONDS)
             self.assertExitFailure(program)
 
     def test_timeout_when_sending_data(self):
@@ -342,7 +461,7 @@ class TestBehaviour(unittest.TestCase):
             sock.send(b'\r\n')
             sock.send(b'Z' * 12)
 
-            time.sleep(WAIT_TIMEOUT)
+            wait_for_exit(program, WAIT_TIMEOUT + QUANTUM_SECONDS)
             self.assertExitFailure(program)
 
     def test_timeout_when_metadata(self):
@@ -355,7 +474,7 @@ class TestBehaviour(unittest.TestCase):
             sock.send(b'\x50')
             sock.send(b"StreamTitle='title of the song';")
 
-            time.sleep(WAIT_TIMEOUT)
+            wait_for_exit(program, WAIT_TIMEOUT + QUANTUM_SECONDS)
             self.assertExitFailure(program)
 
     def test_metadata_requested(self):
@@ -378,5 +497,31 @@ class TestBehaviour(unittest.TestCase):
             data = sock.recv(1000)
             self.assertIn(b"\r\n", data)
 
+@unittest.skipUnless(SOAK_SECONDS, "soak_hours is 0 in config.cfg")
+class TestSoak(SoakMixin, ProcStatsMixin, unittest.TestCase):
+    def test_soak(self):
+        with IcyServer(StreamProfile(title_interval=1)) as server, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(WAIT_TIMEOUT)
+            ports = (choose_port(), choose_port())
+            args_list = [(server.host, "/", str(server.port), "-", str(ports[0]), "yes"),
+                         (server.host, "/", str(server.port), os.devnull, str(ports[1]), "yes")]
+            with players_context(args_list, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as programs:
+                PipeDrain(programs[0].stdout, chunk_size=64 * 1024)  # keeps no history, unlike StdoutCapture
+                commands = itertools.cycle((b'PAUSE', b'PLAY'))
+
+                def pause_or_play():
+                    command = next(commands)
+                    for port in ports:
+                        sock.sendto(command, ('127.0.0.1', port))
+
+                def title():
+                    for port in ports:
+                        self.assertTrue(wait_for_title(sock, port)[0])
+
+                soak = Soak(dict(stdout_player=programs[0], file_player=programs[1]), (pause_or_play, title))
+                self.assertNoGrowth(soak.run())
+
+
 if __name__ == '__main__':
     unittest.main(warnings='ignore')
@@ -3,10 +3,9 @@ import socket
 import subprocess
 from unittest import TestCase
 
-import time
-
 from choose_port import choose_port
-from common import QUANTUM_SECONDS, mock_client
+from common import mock_client
+from wait import wait_for_exit, wait_for_port
 
 PLAYER_PATH = "../zad2/Debug/player"
 
@@ -28,8 +27,8 @@ class TestPlayerRun(TestCase):
     def test_exit(self):
         port = choose_port()
         with player_context(port) as proc:
-            time.sleep(QUANTUM_SECONDS)
+            wait_for_port(port, socket.SOCK_DGRAM, process=proc)
             with mock_client(port, socket.SOCK_DGRAM) as client:
                 client.send(b"QUIT\n")
-            ret = proc.wait(5)
+            ret = wait_for_exit(proc)
             self.assertEqual(ret, 0)
@@ -0,0 +1,68 @@
+import random
+import unittest
+
+import results
+
+
+def build(player, master=None):
+    return dict(player=player * 64, master=(master or player) * 64, host="host", config="config")
+
+
+def player_throughput(rng, digest, mb_per_s, master=None):
+    return dict(benchmark="player_throughput", build=build(digest, master), time=rng.random(),
+                output="file", metadata=True, metaint=8192, bytes=256 * 1024 * 1024,
+                saved_bytes=256 * 1024 * 1024, seconds=rng.uniform(1, 2),
+                mb_per_s=mb_per_s, cpu_s_per_mb=0.01, metadata_overhead=rng.uniform(0, 0.1))
+
+
+def master_load(rng, digest, latency):
+    commands = rng.randint(1900, 2100)
+    errors = rng.randint(0, 5)
+    return dict(benchmark="master_load", build=build(digest), time=rng.random(),
+                concurrency=10, target_rate=200.0, commands=commands, achieved_rate=commands / 10,
+                latency=dict(count=commands, p50=latency, p99=latency * 2, mean=latency, max=latency * 3),
+                errors=errors, timeouts=0, error_rate=errors / commands, failed_connections=0)
+
+
+class TestCompare(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1)  # the significance tests must not depend on luck
+
+    def regressions(self, records, old="a", new="b"):
+        return {(result["benchmark"], result["metric"])
+                for result in results.compare(records, old, new) if result["regression"]}
+
+    def test_throughput_halved(self):
+        records = [player_throughput(self.rng, "a", self.rng.uniform(95, 105)) for _ in range(5)]
+        records += [player_throughput(self.rng, "b", self.rng.uniform(45, 55)) for _ in range(5)]
+        self.assertIn(("player_throughput", "mb_per_s"), self.regressions(records))
+
+    def test_latency_ten_times(self):
+        records = [master_load(self.rng, "a", self.rng.uniform(0.0009, 0.0011)) for _ in range(5)]
+        records += [master_load(self.rng, "b", self.rng.uniform(0.009, 0.011)) for _ in range(5)]
+        regressions = self.regressions(records)
+        self.assertIn(("master_load", "latency.p50"), regressions)
+        self.assertIn(("master_load", "latency.p99"), regressions)
+
+    def test_no_change(self):
+        records = [player_throughput(self.rng, digest, self.rng.uniform(95, 105))
+                   for digest in "ab" for _ in range(5)]
+        self.assertEqual(self.regressions(records), set())
+
+    def test_only_master_changed(self):
+        records = [player_throughput(self.rng, "p", self.rng.uniform(95, 105), master="a") for _ in range(5)]
+        records += [player_throughput(self.rng, "p", self.rng.uniform(45, 55), master="b") for _ in range(5)]
+        with self.assertRaises(ValueError):
+            self.regressions(records, "p", "master:b")
+        self.assertIn(("player_throughput", "mb_per_s"), self.regressions(records, "master:a", "master:b"))
+
+    def test_outcomes_do_not_split_groups(self):
+        first, second = player_throughput(self.rng, "a", 100), player_throughput(self.rng, "a", 100)
+        second.update(saved_bytes=1, seconds=3.0, metadata_overhead=0.5, time=1.0)
+        self.assertEqual(results.parameters(first), results.parameters(second))
+        second.update(metaint=16)
+        self.assertNotEqual(results.parameters(first), results.parameters(second))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""Check recordings against the expected payload without reading them into memory.
+
+Files are memory-mapped and compared chunk by chunk, either against a
+repeated pattern (what IcyServer sends) or against a CRC-32 of the payload.
+PatternVerifier can also follow a file the player is still writing.
+"""
+import mmap
+import os
+import zlib
+
+from wait import WaitTimeout, wait_for_file_growth
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def _first_difference(data, expected):
+    """Offset of the first differing byte of two equally long buffers."""
+    step = 4096
+    for offset in range(0, len(data), step):
+        if data[offset:offset + step] != expected[offset:offset + step]:
+            for i in range(offset, min(offset + step, len(data))):
+                if data[i] != expected[i]:
+                    return i
+    return None
+
+
+class PatternVerifier:
+    """Verifies that a file is ``pattern`` repeated, from its start, in chunks.
+
+    Call check() again when the file has grown; only the new bytes are read.
+    """
+
+    def __init__(self, path, pattern, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.period = len(pattern)
+        chunk_size -= chunk_size % self.period
+        self.chunk_size = max(chunk_size, self.period)
+        # long enough to start at any phase of the pattern
+        self._expected = memoryview(pattern * (self.chunk_size // self.period + 1))
+        self.verified = 0  # bytes known to be correct
+        self.mismatch = None  # offset of the first wrong byte
+
+    def check(self):
+        """Verify everything written so far; return the first mismatch offset or None."""
+        if self.mismatch is not None:
+            return self.mismatch
+        size = os.path.getsize(self.path)
+        if size <= self.verified:
+            return None
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as data:
+            data.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(data) as view:
+                while self.verified < size:
+                    length = min(self.chunk_size, size - self.verified)
+                    phase = self.verified % self.period
+                    expected = self._expected[phase:phase + length]
+                    with view[self.verified:self.verified + length] as chunk:
+                        if chunk != expected:
+                            self.mismatch = self.verified + _first_difference(chunk, expected)
+                            return self.mismatch
+                    self.verified += length
+        return None
+
+    def follow(self, process, timeout=None):
+        """Keep checking while ``process`` runs; return the first mismatch offset or None.
+
+        Stops at a mismatch, once the process has exited and the rest of the
+        file is checked, or when the file has not grown for ``timeout`` seconds.
+        """
+        while self.check() is None and process.poll() is None:
+            try:
+                wait_for_file_growth(self.path, self.verified, timeout)
+            except WaitTimeout:
+                break
+        return self.check()
+
+
+def first_mismatch(path, pattern, chunk_size=CHUNK_SIZE):
+    """Offset of the first byte of ``path`` that breaks the repeated ``pattern``, or None."""
+    return PatternVerifier(path, pattern, chunk_size).check()
+
+
+def file_crc32(path, chunk_size=CHUNK_SIZE):
+    """CRC-32 of a file, computed over an mmap in chunks."""
+    crc = 0
+    size = os.path.getsize(path)
+    if not size:
+        return crc
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as data:
+        data.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(data) as view:
+            for offset in range(0, size, chunk_size):
+                with view[offset:offset + chunk_size] as chunk:
+                    crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def verify_crc32(path, expected_crc, expected_size=None):
+    """True if the file has the expected CRC-32 (and size, if given)."""
+    if expected_size is not None and os.path.getsize(path) != expected_size:
+        return False
+    return file_crc32(path) == expected_crc
@@ -0,0 +1,217 @@
+"""Wait for a condition instead of sleeping for a fixed time.
+
+Every function returns as soon as its condition holds and raises WaitTimeout
+once ``timeout`` (WAIT_TIMEOUT by default) has passed.
+"""
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import select
+import socket
+import struct
+import subprocess
+import time
+
+from common import WAIT_TIMEOUT
+
+POLL_INTERVAL = 0.01
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+_EVENT_HEADER = struct.Struct("iIII")
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+class WaitTimeout(TimeoutError):
+    pass
+
+
+def _deadline(timeout):
+    return time.monotonic() + (WAIT_TIMEOUT if timeout is None else timeout)
+
+
+def wait_until(predicate, timeout=None, message=None, interval=POLL_INTERVAL):
+    """Poll ``predicate`` until it returns something truthy and return that."""
+    deadline = _deadline(timeout)
+    while True:
+        value = predicate()
+        if value:
+            return value
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise WaitTimeout(message or "condition not met: %r" % predicate)
+        time.sleep(min(interval, remaining))
+
+
+class Inotify:
+    """Minimal inotify(7) binding, enough to block until a directory changes."""
+
+    def __init__(self, path, mask=IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO):
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        if _libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch", path)
+
+    def fileno(self):
+        return self.fd
+
+    def read(self, timeout):
+        """Wait up to ``timeout`` seconds and return the names of changed entries."""
+        if not select.select([self.fd], [], [], max(timeout, 0))[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            names.append(data[offset:offset + length].rstrip(b"\0").decode())
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+@contextlib.contextmanager
+def _watch_directory(path):
+    """Yield a function that blocks until something in the directory of ``path`` changes."""
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        watch = Inotify(directory)
+    except OSError:
+        yield lambda timeout: time.sleep(min(POLL_INTERVAL, max(timeout, 0)))
+        return
+    try:
+        yield watch.read
+    finally:
+        watch.close()
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return -1
+
+
+def wait_for_file_size(path, size, timeout=None):
+    """Wait until the file at ``path`` holds at least ``size`` bytes; return its size."""
+    deadline = _deadline(timeout)
+    with _watch_directory(path) as changed:
+        while True:
+            current = _size(path)
+            if current >= size:
+                return current
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise WaitTimeout("%s has %d bytes, expected at least %d" % (path, current, size))
+            changed(remaining)
+
+
+def wait_for_file_growth(path, size=None, timeout=None):
+    """Wait until the file grows beyond ``size`` (its current size by default)."""
+    if size is None:
+        size = _size(path)
+    return wait_for_file_size(path, size + 1, timeout)
+
+
+def wait_for_file_stable(path, quiet, timeout=None):
+    """Wait until the file has not changed for ``quiet`` seconds; return its size."""
+    deadline = _deadline(timeout)
+    with _watch_directory(path) as changed:
+        size = _size(path)
+        quiet_until = time.monotonic() + quiet
+        while True:
+            now = time.monotonic()
+            if now >= quiet_until:
+                return size
+            if now >= deadline:
+                raise WaitTimeout("%s is still changing" % path)
+            changed(min(quiet_until, deadline) - now)
+            current = _size(path)
+            if current != size:
+                size = current
+                quiet_until = time.monotonic() + quiet
+
+
+def _listening_ports(proto):
+    if proto == socket.SOCK_STREAM:
+        tables, listen_state = ("/proc/net/tcp", "/proc/net/tcp6"), "0A"
+    else:
+        tables, listen_state = ("/proc/net/udp", "/proc/net/udp6"), "07"
+    ports = set()
+    for table in tables:
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if fields[3] == listen_state:
+                        ports.add(int(fields[1].rsplit(":", 1)[1], 16))
+        except FileNotFoundError:
+            pass
+    return ports
+
+
+def is_listening(port, proto=socket.SOCK_STREAM):
+    return int(port) in _listening_ports(proto)
+
+
+def wait_for_port(port, proto=socket.SOCK_STREAM, process=None, timeout=None):
+    """Wait until something listens on ``port`` without connecting to it.
+
+    If ``process`` is given, also return (False) as soon as it exits.
+    """
+    def ready():
+        if is_listening(port, proto):
+            return True
+        if process is not None and process.poll() is not None:
+            return "exited"
+        return False
+    return wait_until(ready, timeout, "nothing listens on port %s" % port) is True
+
+
+def wait_for_exit(process, timeout=None):
+    """Wait for ``process`` (a Popen or a pid) to exit.
+
+    The exit is noticed through a pidfd, so no polling is involved. Returns the
+    exit code of a Popen, which is reaped; the exit code of other pids is not
+    available.
+    """
+    timeout = WAIT_TIMEOUT if timeout is None else timeout
+    popen = process if isinstance(process, subprocess.Popen) else None
+    if popen is not None:
+        if popen.returncode is not None:
+            return popen.returncode
+        process = popen.pid
+    try:
+        pidfd = os.pidfd_open(process)
+    except ProcessLookupError:
+        return popen.wait() if popen is not None else None
+    try:
+        if not select.select([pidfd], [], [], timeout)[0]:
+            raise WaitTimeout("process %d still running" % process)
+    finally:
+        os.close(pidfd)
+    return popen.wait() if popen is not None else None
+
+
+def wait_for_readable(sock, timeout=None):
+    """Wait until ``sock`` (anything with fileno()) has data to read."""
+    timeout = WAIT_TIMEOUT if timeout is None else timeout
+    if not select.select([sock], [], [], timeout)[0]:
+        raise WaitTimeout("nothing to read from %r" % sock)
+    return sock